@@ -1,16 +1,23 @@
 from __future__ import annotations
 import asyncio
-import json
 import logging
+import orjson
 import uuid
+import hashlib
+import itertools
 import os
 import pathlib
+import re
 import time
 from dataclasses import asdict, dataclass
-from typing import Any, Dict
-from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+from functools import lru_cache, partial
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 import ipaddress
-import requests
+from cachetools import LRUCache, TTLCache
+from collections import Counter, deque
 from livekit import rtc
 from livekit.agents import (
     AutoSubscribe,
@@ -18,73 +25,142 @@ from livekit.agents import (
     WorkerOptions,
     WorkerType,
     cli,
-    llm,
     multimodal
 )
 from livekit.plugins import google
-from supabase import create_client, Client
+from supabase import acreate_client, AsyncClient
 from dotenv import load_dotenv
 import prompt
-from openai import OpenAI
+from openai import AsyncOpenAI
+import httpx
 import google.generativeai as genai
 from pinecone import Pinecone  # Import Pinecone
-import traceback
-import dotenv
 
 logger = logging.getLogger("my-worker")
 logger.setLevel(logging.INFO)
 
-# Initialize Supabase client
-try:
-    # Explicitly load environment variables first
-    # No need to redefine load_dotenv
-    load_dotenv()
+# Cached UTC tzinfo and an alias for the tzinfo class
+# (get_local_time's `timezone` argument shadows the module name)
+UTC = timezone.utc
+dt_timezone = timezone
 
-    supabase_url = os.environ.get("SUPABASE_URL")
-    supabase_key = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
+# Set by init_clients() once the worker process has started initializing clients
+clients_ready: asyncio.Event = None
 
-    if supabase_url and supabase_key:
-        supabase = create_client(supabase_url, supabase_key)
-        logger.info("Supabase client initialized at module level")
-    else:
-        logger.error("Supabase environment variables missing at module level")
-        supabase = None
-except Exception as e:
-    logger.error(f"Failed to initialize Supabase client at module level: {e}")
-    supabase = None
+# Async Supabase client, created inside the running event loop by init_supabase()
+# so that storage calls never block the loop on an HTTP round-trip
+supabase: AsyncClient = None
+
+# Shared keep-alive HTTP/2 connection pool for outbound API calls
+http_client: httpx.AsyncClient = None
+HTTP_CLIENT_TIMEOUT = 15.0
+HTTP_CLIENT_LIMITS = httpx.Limits(max_keepalive_connections=50, max_connections=100)
 
 # Initialize OpenAI client for web search and embeddings
-openai_client: OpenAI = None
+openai_client: AsyncOpenAI = None
 
 # Initialize Gemini API flag
 gemini_initialized: bool = False
 
+# Cached Gemini model used for web search (built once, reused across calls)
+gemini_search_model = None
+
 # Initialize Pinecone client and index
 pinecone_client: Pinecone = None
 pinecone_index = None
 PINECONE_INDEX_NAME = "coachingbooks"
-EMBEDDING_MODEL = "text-embedding-3-large"  # Match the index
-
-# Global variables for conversation tracking
-conversation_history = []
+# The Pinecone client is synchronous; its queries run on a small dedicated
+# pool so a burst of lookups cannot take over the default executor
+PINECONE_QUERY_WORKERS = 4
+pinecone_executor = ThreadPoolExecutor(
+    max_workers=PINECONE_QUERY_WORKERS, thread_name_prefix="pinecone-query")
+# The embedding model and size must match the index; both can be overridden
+# via EMBEDDING_MODEL / EMBEDDING_DIMENSIONS in the process environment when
+# the index is re-embedded, e.g. text-embedding-3-small at 512 dimensions
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL") or "text-embedding-3-large"  # Match the index
+EMBEDDING_DIMENSIONS = os.environ.get("EMBEDDING_DIMENSIONS") or None  # None keeps the model's native size
+# Validate here so a bad value fails at startup, not on the Pinecone init thread
+if EMBEDDING_DIMENSIONS is not None:
+    if not EMBEDDING_DIMENSIONS.isdigit() or int(EMBEDDING_DIMENSIONS) == 0:
+        raise ValueError(f"EMBEDDING_DIMENSIONS must be a positive integer, got {EMBEDDING_DIMENSIONS!r}")
+    EMBEDDING_DIMENSIONS = int(EMBEDDING_DIMENSIONS)
+EMBEDDING_BATCH_SIZE = 2048  # Maximum inputs per OpenAI embeddings request
+# Embeddings are deterministic per model and text, so keep recent ones
+EMBEDDING_CACHE_MAX_SIZE = 1024
+embedding_cache = LRUCache(maxsize=EMBEDDING_CACHE_MAX_SIZE)
+
+# Short-lived caches for repeated tool queries (keyed by normalized query text)
+TOOL_CACHE_MAX_SIZE = 256
+WEB_SEARCH_CACHE_TTL = 300  # seconds - web results go stale quickly
+KNOWLEDGE_BASE_CACHE_TTL = 600  # seconds - the knowledge base rarely changes
+web_search_cache = TTLCache(maxsize=TOOL_CACHE_MAX_SIZE, ttl=WEB_SEARCH_CACHE_TTL)
+knowledge_base_cache = TTLCache(maxsize=TOOL_CACHE_MAX_SIZE, ttl=KNOWLEDGE_BASE_CACHE_TTL)
+# Queries that found nothing, kept briefly so quick rephrasings skip the lookup
+KNOWLEDGE_BASE_NEGATIVE_CACHE_TTL = 60  # seconds
+knowledge_base_negative_cache = TTLCache(maxsize=TOOL_CACHE_MAX_SIZE, ttl=KNOWLEDGE_BASE_NEGATIVE_CACHE_TTL)
+KNOWLEDGE_BASE_NO_RESULTS = "No specific information found in the knowledge base for that query."
+
+# Geolocation results keyed by IP address (only successful lookups are cached)
+IP_LOCATION_CACHE_MAX_SIZE = 4096
+IP_LOCATION_CACHE_TTL = 3600  # seconds - an IP's location rarely changes within an hour
+ip_location_cache = TTLCache(maxsize=IP_LOCATION_CACHE_MAX_SIZE, ttl=IP_LOCATION_CACHE_TTL)
+# In-flight lookups keyed by IP, so concurrent callers share one request
+ip_location_inflight: Dict[str, asyncio.Task] = {}
+
+# Global variables for conversation tracking. Only the most recent messages
+# stay in memory; stored ones live in Supabase and unsaved ones in
+# pending_messages, so evicting old entries loses nothing
+CONVERSATION_HISTORY_MAX_SIZE = 256
+conversation_history = deque(maxlen=CONVERSATION_HISTORY_MAX_SIZE)
+# Messages recorded this session, including those evicted from the history
+recorded_message_count = 0
+# Messages not yet stored in Supabase, keyed by message_id in insertion order,
+# so a flush never has to rescan conversation_history
+pending_messages: Dict[str, Dict[str, Any]] = {}
+# How many times each assistant reply appears in conversation_history, for O(1)
+# duplicate checks against the recent history
+assistant_contents = Counter()
+# Epoch seconds when the latest message was recorded (read by the inactivity checker)
+last_message_time = 0.0
+# Timestamp of the latest recorded message. Rows are keyed on
+# (session_id, timestamp), so each message gets a strictly later one
+last_recorded_timestamp: Optional[datetime] = None
 session_id = None
 user_message = ""
 timeout_task = None
+# The MultimodalAgent; is_speaking is attached as soon as it is constructed
 agent = None
 
 # OpenAI TTS configuration
 OPENAI_VOICE_ID = "alloy"
 
 # Default interview preparation prompt
-DEFAULT_INTERVIEW_PROMPT = prompt.prompt
+DEFAULT_INTERVIEW_PROMPT = prompt.build_prompt(
+    "[Location context placeholder]", "[Time context placeholder]")
 
 # Local backup for conversations when Supabase is unreachable
 LOCAL_BACKUP_DIR = pathlib.Path("./conversation_backups")
 RETRY_QUEUE_FILE = LOCAL_BACKUP_DIR / "retry_queue.pkl"
 MAX_RETRY_QUEUE_SIZE = 1000  # Maximum messages to store for retry
 
-# Retry queue for failed message storage attempts
-retry_queue = []
+# Retry queue for failed message storage attempts; the oldest entries are
+# dropped once it is full
+retry_queue = deque(maxlen=MAX_RETRY_QUEUE_SIZE)
+
+# Background storage queue so Supabase writes never run on the speaking turn
+STORAGE_QUEUE_MAX_SIZE = 1024  # Overflow spills to the retry queue
+STORAGE_WORKER_COUNT = 4  # Bounds concurrent Supabase writes
+STORAGE_BATCH_MAX = 64  # Most messages a worker sends in one upsert
+STORAGE_BATCH_WINDOW = 0.2  # seconds a worker waits for a batch to fill
+storage_queue = None
+storage_worker_tasks = []
+# Counters for observing the storage queue (logged when it is drained)
+storage_queue_stats = {"enqueued": 0, "spilled": 0, "stored": 0, "failed": 0, "max_depth": 0}
+# One-off storage tasks started outside the queue, awaited when the session ends
+pending_stores = set()
+PENDING_STORES_TIMEOUT = 5.0  # seconds to wait for them at shutdown
+# Longest a session may run before the agent stops waiting for it to end
+MAX_SESSION_DURATION = 2 * 60 * 60  # seconds
 
 # Add a flag to control verbose logging
 VERBOSE_LOGGING = False
@@ -116,12 +192,7 @@ def verbose_log(message, level="info", error=None):
 
 def get_utc_now():
     """Get current UTC time in a timezone-aware manner"""
-    try:
-        # Python 3.11+ approach
-        return datetime.now(datetime.UTC)
-    except AttributeError:
-        # Fallback for earlier Python versions
-        return datetime.now(timezone.utc)
+    return datetime.now(UTC)
 
 # Helper function to get current UTC time with consistent formatting
 
@@ -130,69 +201,72 @@ def get_current_timestamp():
     """Get current UTC time in ISO 8601 format with timezone information"""
     return get_utc_now().isoformat()
 
-# This function now primarily defines the tool for Gemini
+# Tool declarations for Gemini, built once at import time since they never change
 # The actual search execution is handled by `handle_gemini_web_search`
+WEB_SEARCH_TOOL_DECLARATION = {
+    "name": "search_web",
+    "description": (
+        "Searches the web for current information on a specific topic when"
+        " internal knowledge is insufficient or outdated."
+        " Use only for recent"
+        " events, specific factual data (like current salaries),"
+        " or verifying "
+        "contested information."
+    ),
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "search_query": {
+                "type": "string",
+                "description": (
+                    "The specific, optimized query to search for "
+                    "on the web."
+                )
+            },
+            "include_location": {
+                "type": "boolean",
+                "description": (
+                    "Set to true if the user's location is relevant"
+                    " to the search (e.g., local job market)."
+                )
+            }
+        },
+        "required": ["search_query"]
+    }
+}
+
+KNOWLEDGE_BASE_TOOL_DECLARATION = {
+    "name": "query_knowledge_base",
+    "description": (
+        "Searches an internal knowledge base of coaching books"
+        " and principles for established concepts, strategies,"
+        " and general career advice. Prioritize this over web search"
+        " for foundational knowledge."
+    ),
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "query": {
+                "type": "string",
+                "description": (
+                    "The specific question or topic to search for"
+                    " in the knowledge base."
+                )
+            }
+        },
+        "required": ["query"]
+    }
+}
 
 
 def get_web_search_tool_declaration():
     """Returns the function declaration for the web search tool."""
-    return {
-        "name": "search_web",
-        "description": (
-            "Searches the web for current information on a specific topic when"
-            " internal knowledge is insufficient or outdated."
-            " Use only for recent"
-            " events, specific factual data (like current salaries),"
-            " or verifying "
-            "contested information."
-        ),
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "search_query": {
-                    "type": "string",
-                    "description": (
-                        "The specific, optimized query to search for "
-                        "on the web."
-                    )
-                },
-                "include_location": {
-                    "type": "boolean",
-                    "description": (
-                        "Set to true if the user's location is relevant"
-                        " to the search (e.g., local job market)."
-                    )
-                }
-            },
-            "required": ["search_query"]
-        }
-    }
+    return WEB_SEARCH_TOOL_DECLARATION
 
 
 def get_knowledge_base_tool_declaration():
     """Returns the function declaration for the knowledge base tool."""
-    return {
-        "name": "query_knowledge_base",
-        "description": (
-            "Searches an internal knowledge base of coaching books"
-            " and principles for established concepts, strategies,"
-            " and general career advice. Prioritize this over web search"
-            " for foundational knowledge."
-        ),
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "query": {
-                    "type": "string",
-                    "description": (
-                        "The specific question or topic to search for"
-                        " in the knowledge base."
-                    )
-                }
-            },
-            "required": ["query"]
-        }
-    }
+    return KNOWLEDGE_BASE_TOOL_DECLARATION
 
 # Removed the main logic from perform_web_search as it's now split:
 # 1. Declaration: get_web_search_tool_declaration()
@@ -204,6 +278,36 @@ def get_knowledge_base_tool_declaration():
 # 6. Underlying API call: query_pinecone_knowledge_base()
 
 
+def normalize_query(query: str) -> str:
+    """Normalize a tool query (case and whitespace) for use as a cache key"""
+    return " ".join(query.lower().split())
+
+
+def get_gemini_search_model():
+    """
+    Return the cached Gemini model used for web search, creating it on first use.
+
+    Returns:
+        The GenerativeModel instance, or None if no API key is configured
+    """
+    global gemini_search_model, gemini_initialized
+
+    if gemini_search_model is not None:
+        return gemini_search_model
+
+    gemini_api_key = os.environ.get("GEMINI_API_KEY") or os.environ.get("GOOGLE_API_KEY")
+    if not gemini_api_key:
+        return None
+
+    # Configure the SDK once; init_apis may already have done it
+    if not gemini_initialized:
+        genai.configure(api_key=gemini_api_key)
+        gemini_initialized = True
+
+    gemini_search_model = genai.GenerativeModel('gemini-pro')
+    return gemini_search_model
+
+
 async def perform_actual_search(search_query):
     """
     Perform web search using Gemini API.
@@ -214,22 +318,25 @@ async def perform_actual_search(search_query):
     Returns:
         str: Formatted search results text or error message
     """
-    gemini_api_key = os.environ.get("GEMINI_API_KEY") or os.environ.get("GOOGLE_API_KEY")
-    if not gemini_api_key:
-        logger.error("GEMINI_API_KEY or GOOGLE_API_KEY not set in environment variables")
-        return "Unable to perform web search due to missing API key."
+    cache_key = normalize_query(search_query)
+    cached_result = web_search_cache.get(cache_key)
+    if cached_result is not None:
+        logger.info(f"Returning cached web search results for: {search_query}")
+        return cached_result
 
     try:
+        model = get_gemini_search_model()
+        if model is None:
+            logger.error("GEMINI_API_KEY or GOOGLE_API_KEY not set in environment variables")
+            return "Unable to perform web search due to missing API key."
+
         logger.info(f"Querying Gemini with web search for: {search_query}")
-        
-        # Use Gemini model to perform web search
-        genai.configure(api_key=gemini_api_key)
-        model = genai.GenerativeModel('gemini-pro')
-        
+
         # Create a prompt that explicitly asks for web search results
         prompt = f"Please search the web for: {search_query}\n\nProvide a concise summary of the most relevant information, including recent facts, key details, and sources if available. Format the response clearly with sections for different aspects of the information."
-        
-        response = model.generate_content(prompt)
+
+        # Use the async variant so the event loop is not blocked on the request
+        response = await model.generate_content_async(prompt)
         
         if not response or not response.text:
             logger.warning("Gemini returned empty response for web search")
@@ -239,32 +346,35 @@ async def perform_actual_search(search_query):
         results_text = response.text.strip()
         
         logger.info("Gemini web search successful, results generated.")
-        return results_text.strip()
+        web_search_cache[cache_key] = results_text
+        return results_text
 
     except Exception as e:
         logger.error(f"Gemini web search failed: {str(e)}")
         return f"Web search failed during execution: {str(e)}"
 
 
-def verify_supabase_table():
+async def probe_conversation_table():
+    """Issue a minimal HEAD query against conversation_histories (raises on failure)"""
+    return await (
+        supabase.table("conversation_histories")
+        .select("session_id", head=True)
+        .limit(1)
+        .execute()
+    )
+
+
+async def verify_supabase_table():
     """Verify that the conversation_histories table exists and has the correct structure"""
     if not supabase:
         logger.error("Cannot verify table: Supabase client is not initialized")
         return False
 
     try:
-        # Check if table exists
-        result = supabase.table("conversation_histories").select("*").limit(1).execute()
+        # Check that the table and its key column exist. A HEAD request returns
+        # no rows, so no JSONB conversation payload is transferred.
+        await probe_conversation_table()
         logger.info("Successfully connected to conversation_histories table")
-
-        # Log table structure
-        if result.data:
-            logger.info("Table structure:")
-            for key in result.data[0].keys():
-                logger.info(f"- {key}")
-        else:
-            logger.info("Table exists but is empty")
-
         return True
     except Exception as e:
         logger.error(f"Failed to verify conversation_histories table: {str(e)}")
@@ -272,6 +382,20 @@ def verify_supabase_table():
         logger.error(f"Error details: {repr(e)}")
         return False
 
+async def close_supabase_client():
+    """Close the Supabase client's connection pool and drop the client"""
+    global supabase
+    if supabase is None:
+        return
+    client, supabase = supabase, None
+    try:
+        # Only the PostgREST client is used, and it is created lazily
+        postgrest = getattr(client, "_postgrest", None)
+        if postgrest is not None:
+            await postgrest.aclose()
+    except Exception as e:
+        logger.warning(f"Failed to close Supabase client: {e}")
+
 async def init_supabase():
     global supabase
     supabase_url = os.environ.get("SUPABASE_URL")
@@ -289,143 +413,28 @@ async def init_supabase():
         masked_url = supabase_url.replace(supabase_role_key, '[REDACTED]')
         logger.info(f"Initializing Supabase client with URL: {masked_url}")
 
-        supabase = create_client(supabase_url, supabase_role_key)
+        # Replace (never leak) a client left over from an earlier attempt
+        await close_supabase_client()
+        supabase = await acreate_client(supabase_url, supabase_role_key)
         logger.info("Supabase client initialized successfully")
 
-        # Verify table structure
-        if not verify_supabase_table():
+        # Verify table structure (also confirms we can query the table)
+        if not await verify_supabase_table():
             logger.error("Failed to verify conversation_histories table structure")
             return False
 
-        # Test query to ensure we can access the table
-        supabase.table("conversation_histories").select("*").limit(1).execute()
-        logger.info("Successfully tested query on conversation_histories table")
-
         return True
     except Exception as e:
         logger.error(f"Failed to initialize Supabase client: {str(e)}")
         logger.error("Please check your SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY environment variables")
         return False
 
-async def store_conversation_message(
-    session_id: str,
-    role: str,
-    content: str,
-    participant_id: str,
-    metadata: Dict[str, Any] = None
-):
-    """Store a single conversation message in Supabase"""
-    if not supabase:
-        logger.error("Cannot store message: Supabase client is not initialized")
-        return
-
-    try:
-        data = {
-            "session_id": session_id,
-            "role": role,
-            "content": content,
-            "participant_id": participant_id,
-            "metadata": json.dumps(metadata) if metadata else None,
-            "timestamp": datetime.utcnow().isoformat(),
-        }
-
-        logger.info(f"Attempting to store message in conversation_histories:")
-        logger.info(f"Session ID: {session_id}")
-        logger.info(f"Role: {role}")
-        logger.info(f"Participant ID: {participant_id}")
-        logger.info(f"Content length: {len(content)}")
-        logger.info(f"Metadata: {metadata}")
-
-        result = supabase.table("conversation_histories").insert(data).execute()
-
-        if result.data:
-            logger.info(f"Successfully stored message. Response data: {json.dumps(result.data, indent=2)}")
-            return result
-        else:
-            logger.warning("Message stored but no data returned from Supabase")
-            logger.warning(f"Full result object: {result}")
-            return None
-
-    except Exception as e:
-        logger.error(f"Failed to store message in Supabase: {str(e)}")
-        logger.error(f"Error type: {type(e)}")
-        logger.error(f"Error details: {repr(e)}")
-        logger.error(f"Data being stored: {json.dumps(data, indent=2)}")
-        return None
-
-async def store_full_conversation():
-    """Store the entire conversation history to Supabase."""
-    global conversation_history, session_id
-
-    if not supabase:
-        logger.error("Cannot store full conversation: Supabase client is not initialized")
-        return
-
-    if not session_id:
-        logger.error("Cannot store full conversation: session_id is not set")
-        return
-
-    if not conversation_history:
-        logger.info("No conversation history to store")
-        return
-
-    try:
-        # Filter out system messages from the conversation history
-        filtered_conversation = [msg for msg in conversation_history if msg.get("role") != "system"]
-
-        # Get participant_id from the conversation history or use default
-        participant_id = "unknown"
-        for msg in conversation_history:
-            if msg.get("role") == "user" and "metadata" in msg and "participant_identity" in msg.get("metadata", {}):
-                participant_id = msg["metadata"]["participant_identity"]
-                break
-
-        # Create the conversation object with only the essential fields
-        conversation_data = {
-            "session_id": session_id,
-            "participant_id": participant_id,
-            "conversation": filtered_conversation,  # Store only non-system messages
-            "timestamp": datetime.utcnow().isoformat()
-        }
-
-        logger.info(f"Storing conversation with {len(filtered_conversation)} messages")
-        logger.info(f"Last message in history: {json.dumps(filtered_conversation[-1] if filtered_conversation else None, indent=2)}")
-
-        # Check if a record already exists for this session
-        check_query = supabase.table("conversation_histories").select("*").eq("session_id", session_id).execute()
-
-        if check_query.data:
-            logger.info(f"Updating existing conversation record for session {session_id}")
-            result = supabase.table("conversation_histories").update(conversation_data).eq("session_id", session_id).execute()
-        else:
-            logger.info(f"Creating new conversation record for session {session_id}")
-            result = supabase.table("conversation_histories").insert(conversation_data).execute()
-
-        if result.data:
-            logger.info(f"Successfully stored conversation. Response data: {json.dumps(result.data, indent=2)}")
-            return result
-        else:
-            logger.warning("Store operation completed but returned no data")
-            logger.warning(f"Full result object: {result}")
-            return None
-
-    except Exception as e:
-        logger.error(f"Failed to store conversation: {str(e)}")
-        logger.error(f"Error type: {type(e)}")
-        logger.error(f"Error details: {repr(e)}")
-        # Log the conversation history for debugging
-        try:
-            logger.error(f"Conversation data being stored: {json.dumps(conversation_data, indent=2)}")
-        except Exception as debug_err:
-            logger.error(f"Error logging conversation data: {str(debug_err)}")
-        return None
-
 # Function to check Supabase connection health
 
 
 async def check_supabase_health():
     """
-    Check if Supabase connection is healthy and reconnect if needed.
+    Check if Supabase connection is healthy, creating the client if needed.
     Returns True if connection is healthy, False otherwise.
     """
     global supabase
@@ -436,15 +445,161 @@ async def check_supabase_health():
         return await init_supabase()
 
     try:
-        # Test the connection with a simple query
-        test_result = supabase.table("conversation_histories").select(
-            "session_id").limit(1).execute()
+        # Test the connection with a minimal HEAD query
+        await probe_conversation_table()
         logger.debug("Supabase connection is healthy")
         return True
     except Exception as e:
-        logger.warning(
-            f"Supabase connection error: {e}, attempting to reconnect")
-        return await init_supabase()
+        # Keep the process-wide client; its pool reconnects on the next request
+        logger.warning(f"Supabase connection error: {e}")
+        return False
+
+# Message ids only need to be unique, so a random per-process prefix plus a
+# counter replaces a fresh uuid4 on every turn
+MESSAGE_ID_PREFIX = uuid.uuid4().hex[:16]
+message_id_counter = itertools.count(1)
+
+
+def new_message_id() -> str:
+    """Return a message id unique across sessions and processes"""
+    return f"{MESSAGE_ID_PREFIX}-{next(message_id_counter)}"
+
+# Terminal punctuation followed by whitespace and the start of a new sentence,
+# where speech can be split into chunks (decimals like 3.5 never match)
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+(?=[\"'(]?[A-Z0-9])")
+# Words whose trailing period does not end a sentence ("Dr. Smith"). Words
+# that often end a sentence ("Inc.", "U.S.") are left out on purpose.
+NON_TERMINAL_ABBREVIATIONS = frozenset({
+    "mr.", "mrs.", "ms.", "dr.", "prof.", "sr.", "jr.", "st.", "mt.",
+    "vs.", "e.g.", "i.e.", "approx.",
+})
+# Initials ("J. Smith"); "A." and "I." are words that can end a sentence
+NAME_INITIALS = frozenset(f"{letter}." for letter in "BCDEFGHJKLMNOPQRSTUVWXYZ")
+
+
+def split_sentences(text: str) -> list[str]:
+    """Split text into sentences for incremental speech, never returning an empty list"""
+    sentences = []
+    for piece in SENTENCE_BOUNDARY.split(text.strip()):
+        if not piece:
+            continue
+        last_word = sentences[-1].rsplit(None, 1)[-1] if sentences else ""
+        # Rejoin after an abbreviation or an initial
+        if last_word.lower() in NON_TERMINAL_ABBREVIATIONS or last_word in NAME_INITIALS:
+            sentences[-1] = f"{sentences[-1]} {piece}"
+        else:
+            sentences.append(piece)
+    return sentences or [text]
+
+def agent_is_busy() -> bool:
+    """True while the agent is speaking, so background storage work should wait"""
+    return agent is not None and agent.is_speaking
+
+# Track a new message in the conversation history
+def record_message(message):
+    """Append a message to conversation_history and track it until it is stored"""
+    global last_message_time, recorded_message_count, last_recorded_timestamp
+
+    if "message_id" not in message:
+        message["message_id"] = new_message_id()
+
+    # Two turns recorded in the same microsecond would share a conflict key and
+    # one row would overwrite the other; nudge the later one forward instead
+    timestamp = message.get("timestamp")
+    if isinstance(timestamp, str):
+        try:
+            recorded_at = datetime.fromisoformat(timestamp)
+            if last_recorded_timestamp is not None and recorded_at <= last_recorded_timestamp:
+                recorded_at = last_recorded_timestamp + timedelta(microseconds=1)
+                message["timestamp"] = recorded_at.isoformat()
+            last_recorded_timestamp = recorded_at
+        except (TypeError, ValueError):
+            pass
+
+    # The oldest message is about to be evicted; stop matching duplicates on it
+    if len(conversation_history) == conversation_history.maxlen:
+        evicted = conversation_history[0]
+        evicted_content = evicted.get("content")
+        if evicted.get("role") == "assistant" and isinstance(evicted_content, str):
+            # The same reply may still be in the window from a later turn
+            assistant_contents[evicted_content] -= 1
+            if assistant_contents[evicted_content] <= 0:
+                del assistant_contents[evicted_content]
+
+    conversation_history.append(message)
+    recorded_message_count += 1
+    last_message_time = time.time()
+    content = message.get("content")
+    if message.get("role") == "assistant" and isinstance(content, str):
+        assistant_contents[content] += 1
+    metadata = message.get("metadata")
+    if not (metadata and metadata.get("stored")):
+        pending_messages[message["message_id"]] = message
+    return message
+
+
+def reset_conversation_history():
+    """Start a new, empty conversation history"""
+    global recorded_message_count, last_recorded_timestamp
+
+    conversation_history.clear()
+    recorded_message_count = 0
+    last_recorded_timestamp = None
+    pending_messages.clear()
+    assistant_contents.clear()
+
+# Build the conversation_histories row for a single message
+def build_insert_data(session_id, participant_id, message):
+    """Return the Supabase insert row for message, shared by every storage path"""
+    # Only format a fresh timestamp when the message is missing one
+    timestamp = message.get("timestamp") or get_current_timestamp()
+    try:
+        # Convert the message to a proper JSON object for the jsonb column
+        serialized_message = orjson.dumps(message).decode()
+        metadata = message.get("metadata")
+        user_email = metadata.get("user_email", "") if metadata else ""
+    except TypeError as e:
+        logger.error(f"Failed to serialize message data: {e}")
+        # Create a simplified version without problematic fields
+        serialized_message = orjson.dumps({
+            "role": message.get("role", "unknown"),
+            "content": message.get("content", ""),
+            "timestamp": timestamp,
+            "message_id": message.get("message_id")
+        }).decode()
+        user_email = ""
+
+    return {
+        "session_id": session_id,
+        "participant_id": participant_id,
+        "conversation": serialized_message,
+        "raw_conversation": message.get("content", ""),  # Use content as raw_conversation
+        "message_count": 1,  # One row per message
+        "user_email": user_email,
+        "timestamp": timestamp,
+        "email_sent": False  # Default to false for new messages
+    }
+
+# Build one upsert row per distinct message for the batched storage paths
+def build_unique_rows(entries):
+    """Map (session_id, timestamp) to (message, row) for (session_id, participant_id, message) entries
+
+    PostgreSQL rejects an upsert that touches the same conflict key twice. A
+    repeat of the same message keeps a single row; a different message that
+    lands on a taken key has its timestamp nudged forward until the key is
+    free, so both rows are stored.
+    """
+    rows = {}
+    for session_id, participant_id, message in entries:
+        row = build_insert_data(session_id, participant_id, message)
+        key = (row["session_id"], row["timestamp"])
+        while key in rows and rows[key][0].get("message_id") != message.get("message_id"):
+            message["timestamp"] = (datetime.fromisoformat(row["timestamp"])
+                                    + timedelta(microseconds=1)).isoformat()
+            row = build_insert_data(session_id, participant_id, message)
+            key = (row["session_id"], row["timestamp"])
+        rows[key] = (message, row)
+    return rows
 
 # Optimize store_conversation_message to be less resource-intensive
 
@@ -452,13 +607,8 @@ async def check_supabase_health():
 async def store_conversation_message(session_id, participant_id, conversation):
     """Store a conversation message in Supabase, with local backup on failure"""
 
-    # Debug: Print environment variables
-    logger.error(f"SUPABASE_URL: {os.environ.get('SUPABASE_URL')}")
-    logger.error(f"SUPABASE_SERVICE_ROLE_KEY exists: {bool(os.environ.get('SUPABASE_SERVICE_ROLE_KEY'))}")
-    logger.error(f"Global supabase client exists: {supabase is not None}")
-
     # Skip non-essential database operations if agent is actively speaking
-    is_speaking = agent and hasattr(agent, 'is_speaking') and agent.is_speaking
+    is_speaking = agent_is_busy()
 
     # For system messages during speech, defer to retry queue instead of
     # immediate storage
@@ -469,7 +619,7 @@ async def store_conversation_message(session_id, participant_id, conversation):
     # Continue with existing storage logic
     # Check Supabase connection first
     supabase_available = await check_supabase_health()
-    logger.error(f"Supabase health check result: {supabase_available}")
+    logger.debug("Supabase health check result: %s", supabase_available)
 
     if not supabase_available:
         logger.error(
@@ -482,70 +632,22 @@ async def store_conversation_message(session_id, participant_id, conversation):
         logger.error("Message data is empty, skipping storage")
         return False
 
-    # Create a message ID if not present
-    message_id = conversation.get("message_id", str(uuid.uuid4()))
-
-    # Update message data to ensure it has a message_id
-    if "message_id" not in conversation:
-        conversation["message_id"] = message_id
-
-    # Ensure we're using a serializable format for conversation
-    try:
-        # Convert the conversation to a proper JSON object for the jsonb column
-        serialized_conversation = json.dumps(conversation) if isinstance(
-            conversation, dict) else conversation
-
-        # Extract transcript for raw_conversation field
-        content = conversation.get("content", "")
-
-        # Get participant email if available, or use default
-        user_email = ""
-        if isinstance(conversation, dict) and "metadata" in conversation:
-            metadata = conversation.get("metadata", {})
-            if isinstance(metadata, dict) and "user_email" in metadata:
-                user_email = metadata.get("user_email", "")
-
-        # Get the timestamp
-        timestamp = conversation.get("timestamp", get_current_timestamp())
-
-        # Calculate message count (here just set to 1 for individual messages)
-        message_count = 1
-
-    except TypeError as e:
-        logger.error(f"Failed to serialize message data: {e}")
-        # Create a simplified version without problematic fields
-        safe_message = {
-            "role": conversation.get("role", "unknown"),
-            "content": conversation.get("content", ""),
-            "timestamp": conversation.get("timestamp", get_current_timestamp()),
-            "message_id": message_id
-        }
-        serialized_conversation = json.dumps(safe_message)
-        content = safe_message.get("content", "")
-        timestamp = safe_message.get("timestamp", get_current_timestamp())
-        message_count = 1
-        user_email = ""
+    # Create a message ID if not present, and keep it on the message
+    message_id = conversation.get("message_id")
+    if message_id is None:
+        message_id = conversation["message_id"] = new_message_id()
 
     # Prepare the exact insert_data structure matching Supabase table columns
-    insert_data = {
-        "session_id": session_id,
-        "participant_id": participant_id,
-        "conversation": serialized_conversation,
-        "raw_conversation": content,  # Use content as raw_conversation
-        "message_count": message_count,
-        "user_email": user_email,
-        "timestamp": timestamp,
-        "email_sent": False  # Default to false for new messages
-    }
+    insert_data = build_insert_data(session_id, participant_id, conversation)
 
     # Debug: Print the data being sent to Supabase
-    logger.error(f"Attempting to store message for session: {session_id}")
-    logger.error(f"Insert data: {json.dumps({k: v for k, v in insert_data.items() if k != 'conversation'})}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Attempting to store message for session: %s", session_id)
+        logger.debug("Insert data: %s", {k: v for k, v in insert_data.items() if k != 'conversation'})
 
     try:
-        # Use upsert with the documented format from Supabase docs - NOT async
-        logger.error(f"Supabase client before upsert: {supabase is not None}")
-        response = (
+        # Use upsert with the documented format from Supabase docs (async client)
+        response = await (
             supabase.table("conversation_histories")
             # Use appropriate conflict resolution
             .upsert([insert_data], on_conflict="session_id,timestamp")
@@ -553,17 +655,14 @@ async def store_conversation_message(session_id, participant_id, conversation):
         )
 
         # Debug: Print response details
-        logger.error(f"Supabase response: {response}")
-        logger.error(f"Response has data attribute: {hasattr(response, 'data')}")
-        if hasattr(response, 'data'):
-            logger.error(f"Response data: {response.data}")
-        logger.error(f"Response has error attribute: {hasattr(response, 'error')}")
-        if hasattr(response, 'error'):
-            logger.error(f"Response error: {response.error}")
+        logger.debug("Supabase response: %s", response)
 
         # Check response structure following Supabase pattern
         if hasattr(response, 'data') and response.data:
-            logger.info(f"Successfully stored message with ID: {message_id}")
+            logger.info("Successfully stored message with ID: %s", message_id)
+            # Drop it from the pending set so the next full flush skips it
+            conversation.setdefault("metadata", {})["stored"] = True
+            pending_messages.pop(message_id, None)
             return True
         elif hasattr(response, 'error') and response.error:
             logger.error(f"Supabase upsert error: {response.error}")
@@ -581,7 +680,9 @@ async def store_conversation_message(session_id, participant_id, conversation):
 
         # Debug: Print full exception details
         logger.error(f"Exception during Supabase storage: {error_type}: {error_message}")
-        logger.error(f"Exception traceback: {traceback.format_exc()}")
+        # exc_info defers traceback formatting until the record is emitted
+        if VERBOSE_LOGGING:
+            logger.error("Exception traceback:", exc_info=True)
 
         # Log different error types differently
         if "duplicate key" in error_message.lower():
@@ -594,7 +695,8 @@ async def store_conversation_message(session_id, participant_id, conversation):
         else:
             logger.error(f"Failed to store message: {error_type}: {error_message}")
             # Only log full trace in verbose mode
-            verbose_log("Error details: " + traceback.format_exc(), level="error")
+            if VERBOSE_LOGGING:
+                logger.error("Error details:", exc_info=True)
 
         # Add to retry queue for later processing
         add_to_retry_queue(session_id, participant_id, conversation)
@@ -617,180 +719,61 @@ async def store_full_conversation():
         logger.error("Cannot store full conversation: session_id is not set")
         return
 
-    if not conversation_history:
-        logger.info("No conversation history to store")
+    if not pending_messages:
+        logger.info("No unsaved conversation messages to store")
         return
 
     try:
         # Count how many messages need to be stored
-        to_store_count = sum(
-    1 for msg in conversation_history if not msg.get(
-        "metadata", {}).get(
-            "stored", False))
-        
+        to_store_count = len(pending_messages)
 
         if to_store_count == 0:
             logger.info("All messages already stored")
             return
 
-        # Collect messages for batch upsert if possible
-        messages_to_store = []
-
-        for message in conversation_history:
-            if message.get("metadata", {}).get("stored", False):
-                continue  # Skip messages that have already been stored
-
-            # If message doesn't have a message_id yet, add one
-            if "message_id" not in message:
-                message["message_id"] = str(uuid.uuid4())
-
-            # Prepare the message for storage with serialization error handling
-            try:
-                # Ensure we're using a serializable format for conversation
-                serialized_message = json.dumps(
-                    message) if isinstance(message, dict) else message
-
-                # Extract transcript for raw_conversation field
-                content = message.get("content", "")
-
-                # Get participant email if available, or use default
-                user_email = ""
-                if isinstance(message, dict) and "metadata" in message:
-                    metadata = message.get("metadata", {})
-                    if isinstance(metadata, dict) and "user_email" in metadata:
-                        user_email = metadata.get("user_email", "")
-
-                # Get the timestamp
-                timestamp = message.get("timestamp", get_current_timestamp())
-
-                # Get participant_id or use role as fallback
-                participant_id = message.get(
-    "participant_id", message.get(
-        "role", "unknown"))
-
-                # Create an insert item matching the Supabase table structure
-                insert_data = {
-                    "session_id": session_id,
-                    "participant_id": participant_id,
-                    "conversation": serialized_message,
-                    "raw_conversation": content,
-                    "message_count": 1,
-                    "user_email": user_email,
-                    "timestamp": timestamp,
-                    "email_sent": False
-                }
-
-                messages_to_store.append(insert_data)
-            except TypeError as e:
-                logger.error(
-    f"Failed to serialize message for batch storage: {e}")
-                # Create a safe version without problematic fields
-                try:
-                    safe_message = {
-                        "role": message.get("role", "unknown"),
-                        "content": message.get("content", ""),
-                        "timestamp": message.get("timestamp", get_current_timestamp()),
-                        "message_id": message.get("message_id")
-                    }
-
-                    serialized_safe_message = json.dumps(safe_message)
-                    content = safe_message.get("content", "")
-                    timestamp = safe_message.get(
-    "timestamp", get_current_timestamp())
-                    participant_id = message.get(
-    "participant_id", message.get(
-        "role", "unknown"))
-
-                    insert_data = {
-                        "session_id": session_id,
-                        "participant_id": participant_id,
-                        "conversation": serialized_safe_message,
-                        "raw_conversation": content,
-                        "message_count": 1,
-                        "user_email": "",
-                        "timestamp": timestamp,
-                        "email_sent": False
-                    }
-
-                    messages_to_store.append(insert_data)
-                except Exception as safe_err:
-                    logger.error(
-    f"Could not create safe version of message: {safe_err}")
-
-        # Store messages in batches to avoid overwhelming Supabase
-        batch_size = 10
+        # Collect (message, insert_data) pairs for the batch upsert; the
+        # participant_id falls back to the role
+        unique_rows = build_unique_rows(
+            (session_id, message.get("participant_id", message.get("role", "unknown")), message)
+            for message in list(pending_messages.values()))
+        entries = list(unique_rows.values())
         success_count = 0
 
-        for i in range(0, len(messages_to_store), batch_size):
-            batch = messages_to_store[i:i + batch_size]
+        # Store the pending messages in batches of the storage worker's size,
+        # so a long session never builds one huge request and a failed batch
+        # only holds back its own rows; those stay unmarked and are picked up
+        # again by the next flush
+        for start in range(0, len(entries), STORAGE_BATCH_MAX):
+            chunk = entries[start:start + STORAGE_BATCH_MAX]
             try:
-                # Use proper upsert with array pattern - Supabase Python client
-                # is not async
-                response = (
+                response = await (
                     supabase.table("conversation_histories")
-                    .upsert(batch, on_conflict="session_id,timestamp")
+                    .upsert([row for _, row in chunk], on_conflict="session_id,timestamp")
                     .execute()
                 )
 
                 if hasattr(response, 'data') and response.data:
-                    # Mark messages as stored
-                    for j, msg_data in enumerate(batch):
-                        # Find the corresponding message in
-                        # conversation_history
-                        for msg in conversation_history:
-                            # Match by timestamp since message_id might not be
-                            # in the database structure
-                            if (msg.get("timestamp") == msg_data["timestamp"] and
-                                msg.get("role", "unknown") == msg_data["participant_id"]):
-                                if "metadata" not in msg:
-                                    msg["metadata"] = {}
-                                msg["metadata"]["stored"] = True
-                                success_count += 1
-                                break
+                    # Mark messages as stored through the references collected
+                    # above, so no re-scan of conversation_history is needed
+                    for message, _ in chunk:
+                        message.setdefault("metadata", {})["stored"] = True
+                        pending_messages.pop(message["message_id"], None)
+                        success_count += 1
                 else:
                     logger.warning(
-    f"Unexpected response from batch upsert: {response}")
+                        f"Unexpected response from batch upsert: {response}")
             except Exception as e:
                 logger.error(f"Error during batch upsert: {e}")
-                # Individual fallback for failed batch
-                for msg_data in batch:
-                    try:
-                        # Individual storage with more detailed error handling
-                        single_response = (
-                            supabase.table("conversation_histories")
-                            .upsert([msg_data], on_conflict="session_id,timestamp")
-                            .execute()
-                        )
-
-                        if hasattr(
-    single_response,
-     'data') and single_response.data:
-                            for msg in conversation_history:
-                                if (msg.get("timestamp") == msg_data["timestamp"] and
-                                    msg.get("role", "unknown") == msg_data["participant_id"]):
-                                    if "metadata" not in msg:
-                                        msg["metadata"] = {}
-                                    msg["metadata"]["stored"] = True
-                                    success_count += 1
-                                    break
-                    except Exception as single_error:
-                        logger.error(
-    f"Error in fallback single storage: {single_error}")
-
-            # Small delay between batches
-            await asyncio.sleep(0.5)
 
         # Verify success rate
         logger.info(
     f"Successfully stored {success_count}/{to_store_count} messages")
 
-        # Final verification - important for debugging
-        total_stored = sum(
-    1 for msg in conversation_history if msg.get(
-        "metadata", {}).get(
-            "stored", False))
+        # Final verification - important for debugging. Every recorded message
+        # is either still pending or stored, so no history scan is needed
+        total_stored = recorded_message_count - len(pending_messages)
         logger.info(
-            f"Total messages marked as stored: {total_stored}/{len(conversation_history)}")
+            f"Total messages marked as stored: {total_stored}/{recorded_message_count}")
 
     except Exception as e:
         logger.error(f"Failed to store full conversation: {str(e)}")
@@ -798,21 +781,22 @@ async def store_full_conversation():
         logger.error(f"Full error details: {repr(e)}")
         # Emergency backup disabled to prevent serialization errors
 
-# Add a helper method to directly await the storage task when critical
-
 
-async def ensure_storage_completed():
-    """Ensure that conversation storage is completed before proceeding."""
-    try:
-        await store_full_conversation()
-        logger.info("Storage operation completed")
-        return True
-    except Exception as e:
-        logger.error(f"Error during ensured storage: {str(e)}")
-        return False
+# Set once the .env files have been parsed in this process
+env_loaded = False
 
 
 def load_env_files():
+    global env_loaded
+
+    # The files are parsed once per process; later calls have nothing to add
+    if env_loaded:
+        return
+    env_loaded = True
+
+    # Environment from a .env found by the default search, if any
+    load_dotenv()
+
     # Get the paths to both .env files
     agent_env_path = pathlib.Path(__file__).parent / '.env'
     web_env_path = pathlib.Path(__file__).parent.parent / 'web' / '.env.local'
@@ -866,43 +850,131 @@ def load_env_files():
         logger.info("GEMINI_API_KEY starts with: %s",
                     api_key[:15] if api_key else 'EMPTY')
 
-        # Initialize Gemini API if key is available
-        try:
-            genai.configure(api_key=api_key)
-            global gemini_initialized
-            gemini_initialized = True
-            logger.info("Gemini API initialized successfully")
-        except Exception as e:
-            logger.error(f"Failed to initialize Gemini API: {str(e)}")
+    # Log the first line of each .env file when debugging
+    if logger.isEnabledFor(logging.DEBUG):
+        for label, env_path in (("Agent .env", agent_env_path),
+                                ("Web .env.local", web_env_path)):
+            try:
+                if env_path.exists():
+                    with open(env_path, 'r') as f:
+                        first_line = f.readline().strip()
+                    if first_line:
+                        logger.debug("%s first line: %s", label, first_line)
+            except Exception as e:
+                logger.error("Error reading %s file: %s", label, str(e))
+
+# Function to get user's IP location data
+IP_LOCATION_TIMEOUT = 5.0  # Seconds per geolocation provider request
 
-    # Try reading both .env files directly
+
+async def lookup_ip_api(ip_address: str) -> Dict[str, Any]:
+    """Look up an IP via ip-api.com (free, no API key required); {} on failure"""
     try:
-        if agent_env_path.exists():
-            with open(agent_env_path, 'r') as f:
-                lines = f.readlines()
-                if lines:
-                    logger.info("Agent .env first line: %s", lines[0].strip())
+        logger.info(
+    f"Attempting geolocation lookup for IP: {ip_address} via ip-api.com")
+        url = f"http://ip-api.com/json/{ip_address}"
+        response = await get_http_client().get(url, timeout=IP_LOCATION_TIMEOUT)
+
+        if response.status_code == 200:
+            data = response.json()
+            if data.get("status") == "success":
+                logger.info(
+    f"Successfully retrieved geolocation data for {ip_address}")
+                return {
+                    "country": data.get("country"),
+                    "region": data.get("regionName"),
+                    "city": data.get("city"),
+                    "timezone": data.get("timezone"),
+                    "lat": data.get("lat"),
+                    "lon": data.get("lon"),
+                    "isp": data.get("isp"),
+                    "source": "ip-api.com"
+                }
+            else:
+                logger.warning(
+                    f"ip-api.com returned non-success status for {ip_address}: {data.get('status', 'unknown')}")
     except Exception as e:
-        logger.error("Error reading agent .env file: %s", str(e))
+        logger.warning(f"Error with ip-api.com: {str(e)}")
+    return {}
+
 
+async def lookup_ipinfo(ip_address: str) -> Dict[str, Any]:
+    """Look up an IP via ipinfo.io (has free tier with rate limits); {} on failure"""
     try:
-        if web_env_path.exists():
-            with open(web_env_path, 'r') as f:
-                lines = f.readlines()
-                if lines:
-                    logger.info(
-    "Web .env.local first line: %s",
-     lines[0].strip())
+        logger.info(
+    f"Attempting geolocation lookup for IP: {ip_address} via ipinfo.io")
+        ipinfo_token = os.environ.get("IPINFO_TOKEN", "")
+        url = f"https://ipinfo.io/{ip_address}/json"
+        if ipinfo_token:
+            url += f"?token={ipinfo_token}"
+
+        response = await get_http_client().get(url, timeout=IP_LOCATION_TIMEOUT)
+
+        if response.status_code == 200:
+            data = response.json()
+            if "bogon" not in data and "error" not in data:
+                # Parse location from format like "lat,lon"
+                loc_parts = (data.get("loc", "").split(
+                    ",") if data.get("loc") else [])
+                lat = loc_parts[0] if len(loc_parts) > 0 else None
+                lon = loc_parts[1] if len(loc_parts) > 1 else None
+
+                logger.info(
+    f"Successfully retrieved ipinfo.io location data for {ip_address}")
+                return {
+                    "country": data.get("country"),
+                    "region": data.get("region"),
+                    "city": data.get("city"),
+                    "timezone": data.get("timezone"),
+                    "lat": lat,
+                    "lon": lon,
+                    "isp": data.get("org"),
+                    "source": "ipinfo.io"
+                }
+            else:
+                logger.warning(
+    f"ipinfo.io indicates invalid IP: {ip_address}")
     except Exception as e:
-        logger.error("Error reading web .env.local file: %s", str(e))
+        logger.warning(f"Error with ipinfo.io: {str(e)}")
+    return {}
 
-# Function to get user's IP location data
+
+@lru_cache(maxsize=1024)
+def is_public_ip(ip_address: str) -> bool:
+    """Whether ip_address is globally routable; raises ValueError if malformed"""
+    addr = ipaddress.ip_address(ip_address)
+    # is_global also excludes shared (100.64.0.0/10) and other special ranges
+    return addr.is_global and not addr.is_multicast
+
+
+async def lookup_ip_location(ip_address: str) -> Dict[str, Any]:
+    """Query both providers concurrently; cache and return the first valid answer"""
+    # Hedge the two providers: take whichever returns valid data first
+    # and cancel the other, so the slow path costs one timeout, not two
+    pending = {
+        asyncio.create_task(lookup_ip_api(ip_address)),
+        asyncio.create_task(lookup_ipinfo(ip_address)),
+    }
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                location_data = task.result()
+                if location_data:
+                    logger.info("Location data: %s", location_data)
+                    ip_location_cache[ip_address] = location_data
+                    return location_data
+    finally:
+        for task in pending:
+            task.cancel()
+    return {}
 
 
-def get_ip_location(ip_address: str) -> Dict[str, Any]:
+async def get_ip_location(ip_address: str) -> Dict[str, Any]:
     """
     Get location information from an IP address using a free IP geolocation API.
-    Tries multiple APIs in case one fails.
+    Queries both providers concurrently and uses the first valid answer.
 
     Args:
         ip_address: The IP address to look up
@@ -915,86 +987,33 @@ def get_ip_location(ip_address: str) -> Dict[str, Any]:
         return {}
 
     try:
-        # Skip private IP addresses
+        # Skip private, loopback and other non-routable addresses
         try:
-            if ipaddress.ip_address(ip_address).is_private:
+            if not is_public_ip(ip_address):
                 logger.info(
-    f"Skipping geolocation for private IP: {ip_address}")
+                    "Skipping geolocation for non-public IP: %s", ip_address)
                 return {}
         except ValueError:
             logger.warning(f"Invalid IP address format: {ip_address}")
             return {}
 
-        # Try ip-api.com first (free, no API key required)
-        try:
-            logger.info(
-    f"Attempting geolocation lookup for IP: {ip_address} via ip-api.com")
-            url = f"http://ip-api.com/json/{ip_address}"
-            response = requests.get(url, timeout=5)
+        cached_location = ip_location_cache.get(ip_address)
+        if cached_location is not None:
+            logger.info("Returning cached geolocation data for %s", ip_address)
+            return cached_location
 
-            if response.status_code == 200:
-                data = response.json()
-                if data.get("status") == "success":
-                    logger.info(
-    f"Successfully retrieved geolocation data for {ip_address}")
-                    location_data = {
-                        "country": data.get("country"),
-                        "region": data.get("regionName"),
-                        "city": data.get("city"),
-                        "timezone": data.get("timezone"),
-                        "lat": data.get("lat"),
-                        "lon": data.get("lon"),
-                        "isp": data.get("isp"),
-                        "source": "ip-api.com"
-                    }
-                    logger.info(f"Location data: {json.dumps(location_data)}")
-                    return location_data
-                else:
-                    logger.warning(
-                        f"ip-api.com returned non-success status for {ip_address}: {data.get('status', 'unknown')}")
-        except Exception as e:
-            logger.warning(
-                f"Error with ip-api.com: {str(e)}, trying fallback API")
+        # Single-flight: concurrent joins from one IP share a single lookup
+        lookup_task = ip_location_inflight.get(ip_address)
+        if lookup_task is None:
+            lookup_task = asyncio.create_task(lookup_ip_location(ip_address))
+            ip_location_inflight[ip_address] = lookup_task
+            lookup_task.add_done_callback(
+                lambda _: ip_location_inflight.pop(ip_address, None))
 
-        # Fallback to ipinfo.io (has free tier with rate limits)
-        try:
-            logger.info(
-    f"Attempting fallback geolocation lookup for IP: {ip_address} via ipinfo.io")
-            ipinfo_token = os.environ.get("IPINFO_TOKEN", "")
-            url = f"https://ipinfo.io/{ip_address}/json"
-            if ipinfo_token:
-                url += f"?token={ipinfo_token}"
-
-            response = requests.get(url, timeout=5)
-
-            if response.status_code == 200:
-                data = response.json()
-                if "bogon" not in data and "error" not in data:
-                    # Parse location from format like "City, Region, Country"
-                    loc_parts = (data.get("loc", "").split(
-                        ",") if data.get("loc") else [])
-                    lat = loc_parts[0] if len(loc_parts) > 0 else None
-                    lon = loc_parts[1] if len(loc_parts) > 1 else None
-
-                    location_data = {
-                        "country": data.get("country"),
-                        "region": data.get("region"),
-                        "city": data.get("city"),
-                        "timezone": data.get("timezone"),
-                        "lat": lat,
-                        "lon": lon,
-                        "isp": data.get("org"),
-                        "source": "ipinfo.io"
-                    }
-                    logger.info(
-    f"Successfully retrieved fallback location data for {ip_address}")
-                    logger.info(f"Location data: {json.dumps(location_data)}")
-                    return location_data
-                else:
-                    logger.warning(
-    f"ipinfo.io indicates invalid IP: {ip_address}")
-        except Exception as e:
-            logger.warning(f"Error with ipinfo.io: {str(e)}")
+        # Shield so one caller being cancelled does not cancel the shared lookup
+        location_data = await asyncio.shield(lookup_task)
+        if location_data:
+            return location_data
 
         # If all methods fail, try to get a default or estimated location
         # Use environment variable if available
@@ -1021,6 +1040,26 @@ def get_ip_location(ip_address: str) -> Dict[str, Any]:
         return {}
 
 # Function to get local time based on timezone
+UTC_OFFSET_PREFIXES = frozenset(("UTC+", "UTC-", "GMT+", "GMT-"))
+
+
+@lru_cache(maxsize=512)
+def get_zone_info(name: str) -> ZoneInfo:
+    """Resolve an IANA timezone name once per process"""
+    return ZoneInfo(name)
+
+
+def classify_hour(hour: int) -> tuple[str, bool]:
+    """Map a local hour to (time_of_day, within 9-17 working hours)"""
+    if 5 <= hour < 12:
+        time_of_day = "morning"
+    elif 12 <= hour < 17:
+        time_of_day = "afternoon"
+    elif 17 <= hour < 22:
+        time_of_day = "evening"
+    else:
+        time_of_day = "night"
+    return time_of_day, 9 <= hour < 17
 
 
 def get_local_time(timezone: str) -> Dict[str, Any]:
@@ -1033,134 +1072,55 @@ def get_local_time(timezone: str) -> Dict[str, Any]:
     Returns:
         Dictionary with local time information
     """
+    # Results only change once a minute; return a copy since callers mutate it
+    utc_minute = int(get_utc_now().timestamp() // 60)
+    return dict(compute_local_time(timezone, utc_minute))
+
+
+@lru_cache(maxsize=256)
+def compute_local_time(timezone: str, utc_minute: int) -> Dict[str, Any]:
+    """Local time details for timezone at the given UTC minute since the epoch"""
+    utc_now = datetime.fromtimestamp(utc_minute * 60, UTC)
     if not timezone:
         logger.warning("No timezone provided for local time determination")
         return {
-            "local_time": get_utc_now().strftime("%Y-%m-%d %H:%M:%S"),
+            "local_time": utc_now.strftime("%Y-%m-%d %H:%M:%S"),
             "timezone": "UTC",
             "time_of_day": "unknown",
             "is_business_hours": False,
-            "day_of_week": get_utc_now().strftime("%A"),
+            "day_of_week": utc_now.strftime("%A"),
             "source": "fallback_utc"
         }
 
     try:
-        # Try to determine offset from various timezone formats
-        utc_now = get_utc_now()
-        offset_hours = 0
-
-        # Check different timezone format patterns
-        if timezone.startswith("UTC+") or timezone.startswith("GMT+"):
+        # Literal offsets like "UTC+5:30" or "GMT-3" map to a fixed offset;
+        # anything else is treated as an IANA name such as "America/New_York"
+        if timezone[:4] in UTC_OFFSET_PREFIXES:
             try:
-                offset_str = timezone.split("+")[1]
-                # Handle hours:minutes format
-                if ":" in offset_str:
-                    hours, minutes = offset_str.split(":")
-                    offset_hours = int(hours) + (int(minutes) / 60)
-                else:
-                    offset_hours = float(offset_str)
-            except (IndexError, ValueError) as e:
+                sign = 1 if timezone[3] == "+" else -1
+                hours, _, minutes = timezone[4:].partition(":")
+                tz = dt_timezone(sign * timedelta(
+                    hours=float(hours), minutes=int(minutes or 0)))
+            except ValueError as e:
                 logger.warning(
-                    f"Error parsing positive UTC offset from {timezone}: {str(e)}"
+                    f"Error parsing UTC offset from {timezone}: {str(e)}"
                 )
-
-
-        elif timezone.startswith("UTC-") or timezone.startswith("GMT-"):
+                tz = UTC
+        else:
             try:
-                offset_str = timezone.split("-")[1]
-                # Handle hours:minutes format
-                if ":" in offset_str:
-                    hours, minutes = offset_str.split(":")
-                    offset_hours = -1 * (int(hours) + (int(minutes) / 60))
-                else:
-                    offset_hours = -1 * float(offset_str)
-            except (IndexError, ValueError) as e:
-                logger.warning(
-                    f"Error parsing negative UTC offset from {timezone}: {str(e)}"
-                )
+                tz = get_zone_info(timezone)
+            except (ZoneInfoNotFoundError, ValueError) as e:
+                logger.warning(f"Unknown timezone {timezone}, using UTC: {str(e)}")
+                tz = UTC
 
-        # Named timezone handling would be better with pytz, but we can do a simple map
-        # for common timezones if pytz is not available
-        timezone_map = {
-            "America/New_York": -5,  # EST
-            "America/Los_Angeles": -8,  # PST
-            "America/Chicago": -6,  # CST
-            "America/Denver": -7,  # MST
-            "Europe/London": 0,  # GMT
-            "Europe/Paris": 1,  # CET
-            "Europe/Berlin": 1,  # CET
-            "Europe/Moscow": 3,
-            "Asia/Tokyo": 9,
-            "Asia/Shanghai": 8,
-            "Asia/Dubai": 4,
-            "Asia/Singapore": 8,
-            "Australia/Sydney": 10,
-            "Pacific/Auckland": 12
-        }
-
-        # Check if we have this timezone in our map
-        if timezone in timezone_map:
-            offset_hours = timezone_map[timezone]
-            logger.info(
-    f"Found timezone {timezone} in map with offset {offset_hours}")
-
-        # Calculate hours accounting for daylight saving time (very simple approach)
-        # In a real implementation, use a proper timezone library like pytz or
-        # dateutil
-        month = utc_now.month
-        is_northern_summer = 3 <= month <= 10  # Very rough DST approximation
-
-        # Adjust for daylight saving time
-        if is_northern_summer and timezone in [
-            "America/New_York", "America/Chicago", "America/Denver",
-            "America/Los_Angeles", "Europe/London", "Europe/Paris", "Europe/Berlin"
-        ]:
-            offset_hours += 1
-            logger.info(
-    f"Adjusted for daylight saving time, new offset: {offset_hours}")
-
-        # Calculate local time based on offset
-        # Add the offset hours
-        hour_delta = int(offset_hours)
-        minute_delta = int((offset_hours - hour_delta) * 60)
-
-        # Add hours and minutes to create the local time
-        local_time = utc_now
-        local_time = local_time.replace(hour=(utc_now.hour + hour_delta) % 24)
-        if minute_delta != 0:
-            local_time = local_time.replace(
-    minute=(
-        utc_now.minute +
-        minute_delta) %
-         60)
-            if utc_now.minute + minute_delta >= 60:
-                local_time = local_time.replace(
-                    hour=(local_time.hour + 1) % 24)
-
-        # Handle day rollover for negative or positive offsets
-        day_offset = 0
-        if utc_now.hour + hour_delta < 0:
-            day_offset = -1
-        elif utc_now.hour + hour_delta >= 24:
-            day_offset = 1
-
-        # Apply day offset if needed
-        if day_offset != 0:
-            # This is a simplified approach without proper day/month boundary handling
-            # In production, use a proper datetime library
-            local_date = utc_now.date()
-            local_time = local_time.replace(day=(local_date.day + day_offset))
+        # zoneinfo applies the zone's real DST rules and day/month rollover
+        local_time = utc_now.astimezone(tz)
+        offset_hours = local_time.utcoffset().total_seconds() / 3600
+        if offset_hours.is_integer():
+            offset_hours = int(offset_hours)
 
         # Simple time categories for contextual understanding
-        hour = local_time.hour
-        if 5 <= hour < 12:
-            time_of_day = "morning"
-        elif 12 <= hour < 17:
-            time_of_day = "afternoon"
-        elif 17 <= hour < 22:
-            time_of_day = "evening"
-        else:
-            time_of_day = "night"
+        time_of_day, is_working_hour = classify_hour(local_time.hour)
 
         # Create the full local time context
         result = {
@@ -1168,10 +1128,10 @@ def get_local_time(timezone: str) -> Dict[str, Any]:
             "timezone": timezone,
             "timezone_offset": f"UTC{'+' if offset_hours >= 0 else ''}{offset_hours}",
             "time_of_day": time_of_day,
-            "is_business_hours": 9 <= hour < 17 and local_time.weekday() < 5,
+            "is_business_hours": is_working_hour and local_time.weekday() < 5,
             "day_of_week": local_time.strftime("%A"),
             "date": local_time.strftime("%Y-%m-%d"),
-            "approximate_dst": is_northern_summer,
+            "is_dst": bool(local_time.dst()),
             "source": "calculated"
         }
 
@@ -1188,7 +1148,6 @@ def get_local_time(timezone: str) -> Dict[str, Any]:
         logger.error(f"Full error details: {repr(e)}")
 
         # Return UTC time as fallback
-        utc_now = get_utc_now()
         return {
             "local_time": utc_now.strftime("%Y-%m-%d %H:%M:%S"),
             "timezone": "UTC",
@@ -1200,55 +1159,49 @@ def get_local_time(timezone: str) -> Dict[str, Any]:
         }
 
 # Extract client IP address from participant
+# Common headers that might contain the real IP
+IP_HEADERS = (
+    "X-Forwarded-For",
+    "X-Real-IP",
+    "CF-Connecting-IP",  # Cloudflare
+    "True-Client-IP",    # Akamai/Cloudflare
+    "X-Client-IP"        # Amazon CloudFront
+)
 
 
-def extract_client_ip(participant: rtc.Participant) -> str:
+def extract_client_ip(participant: rtc.Participant, metadata: Dict[str, Any]) -> str:
     """
     Try to extract the client IP address from participant information.
     This is a best-effort approach that attempts multiple methods to find the IP.
 
     Args:
         participant: The LiveKit participant
+        metadata: The participant's metadata, already parsed from JSON
 
     Returns:
         The IP address as a string, or empty string if not found
     """
     try:
         # First, check if the IP is in metadata as a direct field
-        if participant.metadata:
-            try:
-                metadata = json.loads(participant.metadata)
-                # Direct ip_address field
-                if metadata.get("ip_address"):
-                    logger.info(
-                        f"Found IP address in metadata.ip_address: {metadata.get('ip_address')}"
-                    )
-                    return metadata.get("ip_address")
-
-                # Check headers if provided
-                if metadata.get("headers"):
-                    headers = metadata.get("headers", {})
-                    # Common headers that might contain the real IP
-                    ip_headers = [
-                        "X-Forwarded-For",
-                        "X-Real-IP",
-                        "CF-Connecting-IP",  # Cloudflare
-                        "True-Client-IP",    # Akamai/Cloudflare
-                        "X-Client-IP"        # Amazon CloudFront
-                    ]
-
-                    for header in ip_headers:
-                        if headers.get(header):
-                            # X-Forwarded-For can contain multiple IPs - take
-                            # the first one
-                            ip = headers.get(header).split(',')[0].strip()
-                            logger.info(
-    f"Found IP address in header {header}: {ip}")
-                            return ip
-            except json.JSONDecodeError as e:
-                logger.error(
-                    f"Error parsing participant metadata for IP: {str(e)}"
+        if metadata:
+            # Direct ip_address field
+            if metadata.get("ip_address"):
+                logger.info(
+                    f"Found IP address in metadata.ip_address: {metadata.get('ip_address')}"
                 )
+                return metadata.get("ip_address")
+
+            # Check headers if provided
+            if metadata.get("headers"):
+                headers = metadata.get("headers", {})
+                for header in IP_HEADERS:
+                    if headers.get(header):
+                        # X-Forwarded-For can contain multiple IPs - take
+                        # the first one
+                        ip = headers.get(header).split(',')[0].strip()
+                        logger.info(
+    f"Found IP address in header {header}: {ip}")
+                        return ip
 
         # Try to get IP from connection info if LiveKit makes it available
         # This is implementation-specific and depends on what LiveKit makes
@@ -1284,10 +1237,6 @@ def extract_client_ip(participant: rtc.Participant) -> str:
         return ""
 
 
-# Load environment variables at startup
-load_env_files()
-
-
 @dataclass
 class SessionConfig:
     instructions: str
@@ -1315,15 +1264,12 @@ class SessionConfig:
         }
         return modalities_map.get(modalities, ["text", "audio"])
 
-    def __eq__(self, other: SessionConfig) -> bool:
-        return self.to_dict() == other.to_dict()
-
 
 def parse_session_config(data: Dict[str, Any]) -> SessionConfig:
     turn_detection = None
 
     if data.get("turn_detection"):
-        turn_detection = json.loads(data.get("turn_detection"))
+        turn_detection = orjson.loads(data.get("turn_detection"))
     else:
         turn_detection = {
             "threshold": 0.5,
@@ -1348,27 +1294,13 @@ def parse_session_config(data: Dict[str, Any]) -> SessionConfig:
 
 
 async def entrypoint(ctx: JobContext):
-    load_env_files()
-
     try:
-        if not await init_supabase():
+        if not await init_clients():
             logger.error("Failed to initialize Supabase in worker process")
             raise Exception("Database connection failed")
 
-        # Initialize OpenAI client for web search
-        global openai_client
-        openai_api_key = os.environ.get("OPENAI_API_KEY")
-        if not openai_api_key:
-            logger.error(
-                "OPENAI_API_KEY not set, web search functionality will be disabled")
-        else:
-            try:
-                openai_client = OpenAI(api_key=openai_api_key)
-                logger.info("OpenAI client initialized for web search")
-            except Exception as openai_error:
-                logger.error(
-                    f"Failed to initialize OpenAI client: {str(openai_error)}"
-                )
+        # Close the shared connection pool when the job shuts down
+        ctx.add_shutdown_callback(close_http_client)
 
         logger.info(f"connecting to room {ctx.room.name}")
         try:
@@ -1400,7 +1332,7 @@ async def entrypoint(ctx: JobContext):
             logger.error(f"Raw metadata content: {repr(participant.metadata)}")
             raise
 
-        logger.info("agent started successfully")
+        logger.info("agent session finished")
 
     except Exception as e:
         logger.error(f"Critical error in entrypoint: {str(e)}")
@@ -1419,6 +1351,8 @@ async def run_multimodal_agent(ctx: JobContext, participant: rtc.Participant):
     periodic_saver_task = None
     retry_processor_task = None
     connection_checker_task = None
+    # Set when the participant disconnects or the room closes
+    session_ended = asyncio.Event()
 
     try:
         # Capture initial metadata to associate with transcript
@@ -1438,10 +1372,11 @@ async def run_multimodal_agent(ctx: JobContext, participant: rtc.Participant):
     f"LiveKit Room SID: {room_sid}, Participant SID: {participant_sid}")
 
         # Store initial session metadata for transcript context
+        session_start_time = get_current_timestamp()
         initial_session_metadata = {
             "role": "system",
             "content": "Session started",
-            "timestamp": get_current_timestamp(),
+            "timestamp": session_start_time,
             "metadata": {
                 "type": "session_start",
                 "room_name": room_name,
@@ -1449,25 +1384,28 @@ async def run_multimodal_agent(ctx: JobContext, participant: rtc.Participant):
                 "participant_identity": participant_identity,
                 "participant_sid": participant_sid,
                 "session_id": session_id,
-                "start_time": get_current_timestamp()
+                "start_time": session_start_time
             }
         }
 
         # Add to conversation history
-        conversation_history = [initial_session_metadata]
+        reset_conversation_history()
+        record_message(initial_session_metadata)
 
-        # Store initial metadata immediately
-        await store_conversation_message(
+        # Store initial metadata immediately; the write runs alongside the
+        # location lookup below and is awaited before the agent starts
+        session_start_write = asyncio.create_task(store_conversation_message(
             session_id=session_id,
             participant_id="system",
             conversation=initial_session_metadata
-        )
+        ))
 
         # Auto-disconnect detection and handling
         async def check_connection_status():
             """Check if the connection is still alive by monitoring activity"""
             inactivity_threshold = 300  # 5 minutes of inactivity triggers a disconnect
             last_activity_time = time.time()  # Initialize with current time
+            auto_disconnect_sent = False  # Inactivity notice recorded at most once
 
             try:
                 while True:
@@ -1475,21 +1413,10 @@ async def run_multimodal_agent(ctx: JobContext, participant: rtc.Participant):
                     # frequency
                     await asyncio.sleep(120)  # Check every 2 minutes
 
-                    # Update last activity time if we have recent messages
-                    if conversation_history:
-                        latest_msg_time = conversation_history[-1].get(
-                            "timestamp", 0)
-                        if isinstance(latest_msg_time, str):
-                            try:
-                                # Try to parse the timestamp if it's a string
-                                latest_dt = datetime.fromisoformat(
-                                    latest_msg_time.replace('Z', '+00:00'))
-                                latest_msg_time = latest_dt.timestamp()
-                            except ValueError:
-                                latest_msg_time = 0
-
-                        if latest_msg_time > last_activity_time:
-                            last_activity_time = latest_msg_time
+                    # Update last activity time if we have recent messages;
+                    # record_message keeps the epoch, so nothing is parsed here
+                    if last_message_time > last_activity_time:
+                        last_activity_time = last_message_time
 
                     # Check inactivity duration
                     inactivity_duration = time.time() - last_activity_time
@@ -1504,23 +1431,23 @@ async def run_multimodal_agent(ctx: JobContext, participant: rtc.Participant):
                             "timestamp": get_current_timestamp()
                         }
 
-                        if system_msg not in conversation_history:
-                            conversation_history.append(system_msg)
-                            # Store in background task without awaiting
-                            asyncio.create_task(store_conversation_message(
+                        if not auto_disconnect_sent:
+                            auto_disconnect_sent = True
+                            record_message(system_msg)
+                            # Hand off to the background storage worker
+                            enqueue_conversation_message(
                                 session_id=session_id,
                                 participant_id="system",
                                 conversation=system_msg
-                            ))
+                            )
 
-                        # Force disconnection
+                        # End the session and leave the room after storing the final state
+                        session_ended.set()
                         try:
-                            # Force disconnect after storing the final state
-                            raise ForceDisconnectError(
-                                "Auto-disconnect triggered due to inactivity")
+                            await ctx.room.disconnect()
                         except Exception as e:
                             logger.error(f"Error during auto-disconnect: {e}")
-                            break
+                        break
 
             except asyncio.CancelledError:
                 logger.info("Connection status checker task cancelled")
@@ -1540,23 +1467,19 @@ async def run_multimodal_agent(ctx: JobContext, participant: rtc.Participant):
                     await asyncio.sleep(60)  # Check every minute
 
                     # Skip if agent is actively speaking
-                    if agent and (hasattr(agent, 'is_speaking') and agent.is_speaking or
-                                 hasattr(agent, 'should_pause_background_tasks') and agent.should_pause_background_tasks()):
+                    if agent_is_busy():
                         logger.debug(
                             "Skipping periodic save during active speech")
                         continue
 
                     if conversation_history:
-                        unsaved_count = sum(
-    1 for msg in conversation_history if not msg.get(
-        "metadata", {}).get(
-            "stored", False))
+                        unsaved_count = len(pending_messages)
                         if unsaved_count > 0:
                             logger.info(
     f"Periodic save: Found {unsaved_count} unsaved messages")
                             # Instead of awaiting, create a low-priority
                             # background task
-                            asyncio.create_task(store_full_conversation())
+                            track_store_task(store_full_conversation())
                         else:
                             logger.debug(
                                 "Periodic save: All messages already saved")
@@ -1574,17 +1497,25 @@ async def run_multimodal_agent(ctx: JobContext, participant: rtc.Participant):
         retry_processor_task = asyncio.create_task(periodic_retry_processor())
         logger.info("Started periodic retry processor task")
 
+        # Start the background storage worker
+        start_storage_worker()
+
         # Parse metadata safely
         try:
-            metadata = json.loads(
+            metadata = orjson.loads(
     participant.metadata) if participant.metadata else {}
             logger.info(f"Parsed metadata: {metadata}")
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             logger.error( 
                 f"Failed to parse metadata: {str(e)}, using empty dict"
             )
             metadata = {}
 
+        # Read the user email once; every user message is tagged with it
+        user_email = metadata.get("user_email", "") if isinstance(metadata, dict) else ""
+        if user_email:
+            logger.info(f"Found user email in metadata: {user_email}")
+
         # Immediately extract location and time data, before doing anything
         # else
         logger.info("Extracting user location and time context...")
@@ -1595,28 +1526,25 @@ async def run_multimodal_agent(ctx: JobContext, participant: rtc.Participant):
 
         # First try to get IP address - this is our primary source of location
         # data
-        client_ip = extract_client_ip(participant)
+        client_ip = extract_client_ip(participant, metadata)
         if client_ip:
-            logger.info(f"Successfully extracted client IP: {client_ip}")
+            logger.info("Successfully extracted client IP: %s", client_ip)
             # Get geolocation data from IP
-            location_data = get_ip_location(client_ip)
+            location_data = await get_ip_location(client_ip)
             if location_data:
                 logger.info(
-                    f"Successfully got location data from IP: {json.dumps(location_data)}"
-                )
+                    "Successfully got location data from IP: %s", location_data)
                 user_context["location"] = location_data
 
                 # If we have a timezone from geolocation, get local time
                 # immediately
                 if location_data.get("timezone"):
                     logger.info(
-                        f"Getting local time from IP timezone: {location_data.get('timezone')}"
-                    )
+                        "Getting local time from IP timezone: %s", location_data.get('timezone'))
                     user_context["local_time"] = get_local_time(
                         location_data.get("timezone"))
                     logger.info(
-                        f"Local time determined: {json.dumps(user_context['local_time'])}"
-                    )
+                        "Local time determined: %s", user_context['local_time'])
             else:
                 logger.warning("Could not determine location from IP address")
         else:
@@ -1626,8 +1554,7 @@ async def run_multimodal_agent(ctx: JobContext, participant: rtc.Participant):
         # priority than IP)
         if metadata.get("location"):
             logger.info(
-                f"Client provided location data: {json.dumps(metadata.get('location'))}"
-            )
+                "Client provided location data: %s", metadata.get('location'))
             user_context["location"].update(metadata.get("location"))
 
         # Check if client directly provided timezone or local time data
@@ -1650,21 +1577,16 @@ async def run_multimodal_agent(ctx: JobContext, participant: rtc.Participant):
             try:
                 time_str = metadata.get("local_time")
                 if ":" in time_str:  # Simple check for time format
-                    hour_part = time_str.split(":")[0]
-                    if "T" in hour_part:  # ISO format like 2023-01-01T14:30:00
-                        hour_part = hour_part.split("T")[1]
-                    hour = int(hour_part.strip())
-
-                    if 5 <= hour < 12:
-                        user_context["local_time"]["time_of_day"] = "morning"
-                    elif 12 <= hour < 17:
-                        user_context["local_time"]["time_of_day"] = "afternoon"
-                    elif 17 <= hour < 22:
-                        user_context["local_time"]["time_of_day"] = "evening"
-                    else:
-                        user_context["local_time"]["time_of_day"] = "night"
-
-                    user_context["local_time"]["is_business_hours"] = 9 <= hour < 17
+                    try:
+                        # ISO format like 2023-01-01T14:30:00
+                        hour = datetime.fromisoformat(time_str).hour
+                    except ValueError:
+                        # Bare clock time like 14:30
+                        hour = int(time_str.split(":", 1)[0])
+
+                    time_of_day, is_working_hour = classify_hour(hour)
+                    user_context["local_time"]["time_of_day"] = time_of_day
+                    user_context["local_time"]["is_business_hours"] = is_working_hour
                     logger.info(
                         f"Inferred time of day: {user_context['local_time']['time_of_day']}"
                     )
@@ -1695,7 +1617,7 @@ async def run_multimodal_agent(ctx: JobContext, participant: rtc.Participant):
         initial_context_message = {
             "role": "system",
             "content": "User context information collected at session start",
-            "timestamp": get_utc_now().isoformat(),
+            "timestamp": get_current_timestamp(),
             "metadata": {
                 "type": "session_start_context",
                 "user_location": user_context.get("location", {}),
@@ -1704,27 +1626,24 @@ async def run_multimodal_agent(ctx: JobContext, participant: rtc.Participant):
         }
 
         # Keep track of conversation history
-        conversation_history = []
-        conversation_history.append(initial_context_message)
+        reset_conversation_history()
+        record_message(initial_context_message)
 
         # Immediately store the initial context to database to ensure we capture location data
-        # Even if the session ends prematurely
-        try:
-            # Store context message in database immediately
-            await store_conversation_message(
-                session_id=session_id,
-                participant_id="system",
-                conversation=initial_context_message
-            )
-            logger.info(
-                "Successfully stored user location context in database immediately")
-        except Exception as e:
-            logger.error(f"Failed to store initial location context: {str(e)}")
-            logger.error(f"Error type: {type(e)}")
-            logger.error(f"Full error details: {repr(e)}")
+        # Even if the session ends prematurely. The write runs while the agent
+        # is being built and is awaited just before the agent starts
+        initial_context_write = asyncio.create_task(store_conversation_message(
+            session_id=session_id,
+            participant_id="system",
+            conversation=initial_context_message
+        ))
 
-        # Load the base prompt
-        base_prompt = prompt.prompt
+        # Location is fixed for the session, so the web search suffix is
+        # built once here rather than on every tool call
+        session_location_suffix = ""
+        loc = user_context["location"]
+        if loc.get("city") and loc.get("country"):
+            session_location_suffix = f" in {loc['city']}, {loc['country']}"
 
         # Prepare context strings
         location_context_str = "No specific location context available."
@@ -1747,10 +1666,8 @@ async def run_multimodal_agent(ctx: JobContext, participant: rtc.Participant):
             time_context_str = f"User time: {'; '.join(parts)}"
 
         # Inject context into the prompt
-        system_instructions = base_prompt.replace(
-    "{{LOCATION_CONTEXT}}", location_context_str)
-        system_instructions = system_instructions.replace(
-            "{{TIME_CONTEXT}}", time_context_str)
+        system_instructions = prompt.build_prompt(
+            location_context_str, time_context_str)
         logger.info("Injected user context into system prompt.")
 
         # Initialize the Multimodal Agent with RealtimeModel
@@ -1779,6 +1696,19 @@ async def run_multimodal_agent(ctx: JobContext, participant: rtc.Participant):
             logger.info(
                 "Successfully created MultimodalAgent with is_speaking attribute.")
 
+            # Session-constant metadata shared by every user message; each
+            # message gets its own copy since "stored" is updated per message
+            user_message_metadata = {
+                "type": "user_speech",
+                "stored": False,
+                "room_name": room_name,
+                "room_sid": room_sid,
+                "participant_identity": participant_identity,
+                "participant_sid": participant_sid,
+                "session_id": session_id,
+                "user_email": user_email
+            }
+
             # Update last_message_time when user speaks
             # Event provides transcript string directly for MultimodalAgent
             def on_user_speech_committed(transcript: str):
@@ -1791,70 +1721,34 @@ async def run_multimodal_agent(ctx: JobContext, participant: rtc.Participant):
                         logger.debug(
                             "Received user speech while agent is speaking, deferring processing")
 
-                    # Track message time
-                    message_time = asyncio.get_event_loop().time()
-
                     # Reduce logging during conversation
                     logger.debug(
-                        f"User speech committed: {transcript[:30]}...")
+                        "User speech committed: %.30s...", transcript)
 
                     # Update the user_message variable (potentially for other
                     # uses)
                     user_message = transcript
 
-                    # Try to extract user email from metadata if available
-                    user_email = ""
-                    try:
-                        if participant and participant.metadata:
-                            metadata = json.loads(
-    participant.metadata) if isinstance(
-        participant.metadata,
-         str) else participant.metadata
-                            if isinstance(
-    metadata, dict) and "user_email" in metadata:
-                                user_email = metadata.get("user_email", "")
-                                logger.info(
-    f"Found user email in metadata: {user_email}")
-                    except Exception as email_err:
-                        logger.warning(
-    f"Could not extract user email: {email_err}")
-
                     # Create complete user message with LiveKit context
                     user_chat_message = {
                         "role": "user",
                         "content": transcript,
                         "timestamp": get_current_timestamp(),
-                        "message_id": str(uuid.uuid4()),
-                        "metadata": {
-                            "type": "user_speech",
-                            "stored": False,
-                            "room_name": room_name,
-                            "room_sid": room_sid,
-                            "participant_identity": participant_identity,
-                            "participant_sid": participant_sid,
-                    "session_id": session_id,
-                            "user_email": user_email
-                        }
+                        "message_id": new_message_id(),
+                        "metadata": {**user_message_metadata}
                     }
 
-                    # Only add additional context data when not speaking to
-                    # reduce processing
-                    if not agent.is_speaking:
-                        user_chat_message["metadata"]["user_location"] = user_context.get(
-                            "location", {})
-                        user_chat_message["metadata"]["user_local_time"] = user_context.get(
-                            "local_time", {})
+                    # Location and local time are stored once per session in
+                    # the session_start_context row, not on every turn
 
                     # Add to conversation history
-                    conversation_history.append(user_chat_message)
-
-                    # Create a low-priority background task for storage
-                    asyncio.create_task(
-                        store_conversation_message(
-                            session_id=session_id,
-                            participant_id="user",
-                            conversation=user_chat_message
-                        )
+                    record_message(user_chat_message)
+
+                    # Hand off to the background storage worker
+                    enqueue_conversation_message(
+                        session_id=session_id,
+                        participant_id="user",
+                        conversation=user_chat_message
                     )
 
                 except Exception as e:
@@ -1909,21 +1803,21 @@ async def run_multimodal_agent(ctx: JobContext, participant: rtc.Participant):
             logger.warning("Agent will continue without tool functionality")
         # --- End Function Calling Section ---
 
+        # Resolve the agent's history hook once; the tool handlers below
+        # reuse it on every call
+        agent_add_to_history = getattr(agent, "add_to_history", None)
+
         # Function to handle the actual web search when called by Gemini
         async def handle_gemini_web_search(
             search_query: str,
             include_location: bool = False):
                     """Handles the web search request triggered by Gemini function call."""
-                    logger.info(f"Gemini requested web search for: {search_query}")
+                    logger.info("Gemini requested web search for: %s", search_query)
 
                     query_to_search = search_query
-                    if include_location and user_context.get("location"):
-                        loc = user_context["location"]
-                        if loc.get("city") and loc.get("country"):
-                            location_str = f" in {loc.get('city')}, {loc.get('country')}"
-
-                            query_to_search += location_str
-                            logger.info(f"Added location context: {location_str}")
+                    if include_location and session_location_suffix:
+                        query_to_search += session_location_suffix
+                        logger.info("Added location context: %s", session_location_suffix)
 
                     # Perform the actual search
                     search_results = await perform_actual_search(query_to_search)
@@ -1936,21 +1830,26 @@ async def run_multimodal_agent(ctx: JobContext, participant: rtc.Participant):
 
                         # Attempt to add to history as a system message
                         try:
-                            if hasattr(agent, 'add_to_history'):  # Check if agent has this method
-                                await agent.add_to_history(role="system", content=search_results)
+                            if agent_add_to_history is not None:  # Check if agent has this method
+                                await agent_add_to_history(role="system", content=search_results)
 
                                 # Add to conversation history
                                 system_message = {
                                     "role": "system",
                                     "content": search_results,
-                                    "timestamp": datetime.utcnow().isoformat(),
+                                    "timestamp": get_current_timestamp(),
                                     "metadata": {"type": "web_search", "query": search_query}
                                 }
-                                conversation_history.append(system_message)
-
-                                # Store full conversation to Supabase
-                                await store_full_conversation()
-                                logger.info("Added web search results to conversation history and stored to Supabase")
+                                record_message(system_message)
+
+                                # Only the new message needs storing; hand it to
+                                # the background storage worker
+                                enqueue_conversation_message(
+                                    session_id=session_id,
+                                    participant_id="system",
+                                    conversation=system_message
+                                )
+                                logger.info("Added web search results to conversation history and queued for Supabase")
                             else:
                                 logger.warning("MultimodalAgent may not support add_to_history directly. Results not added.")
                         except Exception as e:
@@ -1964,7 +1863,7 @@ async def run_multimodal_agent(ctx: JobContext, participant: rtc.Participant):
         # Function to handle the knowledge base query when called by Gemini
         async def handle_knowledge_base_query(query: str):
             """Handles the knowledge base query triggered by Gemini function call."""
-            logger.info(f"Gemini requested knowledge base query for: {query}")
+            logger.info("Gemini requested knowledge base query for: %s", query)
 
             # Query Pinecone
             kb_results = await query_pinecone_knowledge_base(query)
@@ -1978,9 +1877,8 @@ async def run_multimodal_agent(ctx: JobContext, participant: rtc.Participant):
 
                 # Attempt to add to history as a system message
                 try:
-                    if hasattr(agent, 'add_to_history'):
-                        await agent.add_to_history(role="system", content=kb_results)
-                        await store_full_conversation()
+                    if agent_add_to_history is not None:
+                        await agent_add_to_history(role="system", content=kb_results)
                         logger.info("Attempted to add knowledge base results to MultimodalAgent history.")
                     else:
                         logger.warning("MultimodalAgent may not support add_to_history directly. KB Results not added.")
@@ -1989,12 +1887,12 @@ async def run_multimodal_agent(ctx: JobContext, participant: rtc.Participant):
 
                 return kb_results # Return this after the try/except block
             else:
-                logger.info(f"Knowledge base query failed or returned no results: {kb_results}")
+                logger.info("Knowledge base query failed or returned no results: %s", kb_results)
 
                 # Optionally inform LLM that nothing was found
                 try:
-                    if hasattr(agent, 'add_to_history'):
-                        await agent.add_to_history(role="system", content="The knowledge base query did not return relevant information.")
+                    if agent_add_to_history is not None:
+                        await agent_add_to_history(role="system", content="The knowledge base query did not return relevant information.")
                     else:
                         logger.warning("MultimodalAgent may not support add_to_history directly. KB empty result not added.")
                 except Exception as e:
@@ -2007,81 +1905,32 @@ async def run_multimodal_agent(ctx: JobContext, participant: rtc.Participant):
 
         # Register event handlers for message storage
         try:
-            # Try multiple events for assistant responses
-            @agent.on("assistant_response")
-            def on_assistant_response(msg: llm.ChatMessage):
-                try:
-                    logger.info(f"ASSISTANT RESPONSE EVENT: {msg.content}")
-                    if isinstance(msg.content, list):
-                        msg_content = "\n".join(str(item) for item in msg.content)
-                    else:
-                        msg_content = msg.content
-
-                    asyncio.create_task(store_assistant_message(msg_content, "assistant_response"))
-                except Exception as e:
-                    logger.error(f"Error in assistant_response callback: {str(e)}")
-                    logger.error(f"Error type: {type(e)}")
-                    logger.error(f"Full error details: {repr(e)}")
-
-            @agent.on("message_sent")
-            def on_message_sent(msg: Any):
+            def on_assistant_event(event_type: str, msg: Any):
+                """Store an assistant reply from any agent event.
+
+                The same reply can surface through several events;
+                store_assistant_message skips it once it is in the recent
+                history, so each reply is stored once.
+                """
+                logger.info("%s EVENT: %s", event_type.upper(), msg)
                 try:
-                    logger.info(f"MESSAGE SENT EVENT: {msg}")
-
-                    # Check if this is an assistant message
-                    if hasattr(msg, 'role') and msg.role == "assistant":
-                        if hasattr(msg, 'content'):
-                            if isinstance(msg.content, list):
-                                msg_content = "\n".join(str(item) for item in msg.content)
-                            else:
-                                msg_content = msg.content
-
-                            asyncio.create_task(store_assistant_message(msg_content, "message_sent"))
+                    # assistant_response carries replies without a role
+                    if event_type != "assistant_response" and getattr(msg, 'role', None) != "assistant":
+                        return
+                    if not hasattr(msg, 'content'):
+                        return
+                    msg_content = msg.content
+                    if isinstance(msg_content, list):
+                        msg_content = "\n".join(str(item) for item in msg_content)
+                    track_store_task(store_assistant_message(msg_content, event_type))
                 except Exception as e:
-                    logger.error(f"Error in message_sent handler: {str(e)}")
+                    logger.error(f"Error in {event_type} handler: {str(e)}")
                     logger.error(f"Error type: {type(e)}")
                     logger.error(f"Full error details: {repr(e)}")
 
-            @agent.on("llm_response_complete")
-            def on_llm_response_complete(msg: Any):
-                try:
-                    logger.info(f"LLM RESPONSE COMPLETE EVENT: {msg}")
-
-                    # Check if this is an assistant message with content
-                    if hasattr(msg, 'role') and msg.role == "assistant" and hasattr(msg, 'content'):
-                        if isinstance(msg.content, list):
-                            msg_content = "\n".join(str(item) for item in msg.content)
-                        else:
-                            msg_content = msg.content
-
-                        asyncio.create_task(store_assistant_message(msg_content, "llm_response_complete"))
-                except Exception as e:
-                    logger.error(f"Error in llm_response_complete handler: {str(e)}")
-                    logger.error(f"Error type: {type(e)}")
-                    logger.error(f"Full error details: {repr(e)}")
-
-            # Add a message handler to log all messages for debugging
-            @agent.on("message")
-            def on_message(msg: Any):
-                try:
-                    logger.info(f"MESSAGE EVENT RECEIVED: {msg}")
-                    if hasattr(msg, 'content'):
-                        logger.info(f"Message content: {msg.content}")
-                    if hasattr(msg, 'role'):
-                        logger.info(f"Message role: {msg.role}")
-
-                        # If this is an assistant message that we haven't captured through other events
-                        if msg.role == "assistant" and hasattr(msg, 'content'):
-                            # Check if we already have this message in our history
-                            msg_content = msg.content
-                            if isinstance(msg_content, list):
-                                msg_content = "\n".join(str(item) for item in msg_content)
-
-                            asyncio.create_task(store_assistant_message(msg_content, "message"))
-                except Exception as e:
-                    logger.error(f"Error in message handler: {str(e)}")
-                    logger.error(f"Error type: {type(e)}")
-                    logger.error(f"Full error details: {repr(e)}")
+            # Try multiple events for assistant responses
+            for event_type in ("assistant_response", "message_sent", "llm_response_complete", "message"):
+                agent.on(event_type, partial(on_assistant_event, event_type))
 
             logger.info("Registered all message handlers for Supabase conversation storage")
         except Exception as e:
@@ -2089,6 +1938,15 @@ async def run_multimodal_agent(ctx: JobContext, participant: rtc.Participant):
             logger.error(f"Error type: {type(e)}")
             logger.error(f"Full error details: {repr(e)}")
 
+        try:
+            await asyncio.gather(session_start_write, initial_context_write)
+            logger.info(
+                "Successfully stored session start and user location context in database")
+        except Exception as e:
+            logger.error(f"Failed to store initial location context: {str(e)}")
+            logger.error(f"Error type: {type(e)}")
+            logger.error(f"Full error details: {repr(e)}")
+
         # Start the agent
         agent.start(ctx.room)
 
@@ -2099,12 +1957,20 @@ async def run_multimodal_agent(ctx: JobContext, participant: rtc.Participant):
             logger.info("Frontend user ended the call - cleaning up resources")
 
             async def async_disconnect_tasks():
+                try:
+                    await store_session_end()
+                finally:
+                    # Let run_multimodal_agent wind down the background tasks
+                    session_ended.set()
+
+            async def store_session_end():
                 # Create a complete session end message with full context
+                session_end_time = get_current_timestamp()
                 session_end_message = {
             "role": "system",
                     "content": "Call ended by user via frontend",
-                    "timestamp": get_current_timestamp(),
-                    "message_id": str(uuid.uuid4()),
+                    "timestamp": session_end_time,
+                    "message_id": new_message_id(),
                     "metadata": {
                         "type": "session_end",
                         "reason": "user_ended",
@@ -2113,11 +1979,11 @@ async def run_multimodal_agent(ctx: JobContext, participant: rtc.Participant):
                         "participant_identity": participant_identity,
                         "participant_sid": participant_sid,
                         "session_id": session_id,
-                        "end_time": get_current_timestamp(),
+                        "end_time": session_end_time,
                         "stored": False
                     }
                 }
-                conversation_history.append(session_end_message)
+                record_message(session_end_message)
 
                 # Store final session state and end message
                 await store_conversation_message(
@@ -2126,14 +1992,12 @@ async def run_multimodal_agent(ctx: JobContext, participant: rtc.Participant):
                     conversation=session_end_message
                 )
 
-                # Store full conversation to ensure complete transcript
-                await store_full_conversation()
-
-                # Ensure all messages are properly stored
+                # Ensure all messages are properly stored; this drains the
+                # storage queue and then flushes whatever is still pending
                 await ensure_storage_completed()
 
                 # Count any messages that failed to store for logging
-                failed_messages = sum(1 for msg in conversation_history if not msg.get("metadata", {}).get("stored", False))
+                failed_messages = len(pending_messages)
                 if failed_messages > 0:
                     logger.warning(f"Disconnecting with {failed_messages} unstored messages")
                 else:
@@ -2158,108 +2022,140 @@ async def run_multimodal_agent(ctx: JobContext, participant: rtc.Participant):
 
         # Register the synchronous handler directly and store the reference
         participant_disconnect_handler = ctx.room.on("participant_disconnected", on_participant_disconnected_sync)
+        # A room closed from the server side ends the session as well
+        ctx.room.on("disconnected", lambda *args: session_ended.set())
         logger.info("Registered participant disconnection handler")
+        # A participant who left before the handler existed never fires it
+        if not ctx.room.remote_participants:
+            logger.info("Participant already left the room, ending the session")
+            session_ended.set()
+
+        # Set when the user barges in on the agent, so say_and_store stops a
+        # multi-sentence reply instead of speaking its remaining sentences
+        speech_interrupted = asyncio.Event()
+        agent.on("agent_speech_interrupted", lambda *args: speech_interrupted.set())
+        agent.on("user_started_speaking", lambda *args: speech_interrupted.set())
 
         # Optimize speech handling to minimize interruptions
+        # Session-constant metadata for spoken assistant messages; copied per
+        # message because the storage paths set "stored" on each message
+        agent_speech_metadata = {
+            "type": "agent_speech",
+            "room_name": room_name,
+            "room_sid": room_sid,
+            "participant_identity": participant_identity,
+            "participant_sid": participant_sid,
+            "session_id": session_id
+        }
+
         async def say_and_store(message_text):
+            message_recorded = False
             try:
                 # Create a message with complete LiveKit context
                 assistant_message = {
                     "role": "assistant",
                     "content": message_text,
                     "timestamp": get_current_timestamp(),
-                    "message_id": str(uuid.uuid4()),
-                    "metadata": {
-                        "type": "agent_speech",
-                        "room_name": room_name,
-                        "room_sid": room_sid,
-                        "participant_identity": participant_identity,
-                        "participant_sid": participant_sid,
-                        "session_id": session_id,
-                        "user_location": user_context.get("location", {}),
-                        "user_local_time": user_context.get("local_time", {})
-                    }
+                    "message_id": new_message_id(),
+                    "metadata": {**agent_speech_metadata}
                 }
 
-                logger.info(f"Preparing to speak: {message_text[:50]}...")
+                logger.info("Preparing to speak: %.50s...", message_text)
 
-                # First, prepare the audio - this caches the audio before playback begins
-                # This helps reduce the delay between transcript and audio
-                try:
-                    preparation_task = asyncio.create_task(agent.prepare_say(message_text))
+                # Speak sentence by sentence so playback starts once the first
+                # sentence is prepared, while the next one is prepared during it
+                sentences = split_sentences(message_text)
 
+                def start_preparation(text):
+                    try:
+                        return asyncio.create_task(agent.prepare_say(text))
+                    except Exception as e:
+                        logger.warning(f"Audio preparation not supported or failed: {str(e)}")
+                        return None
+
+                async def wait_for_preparation(task):
                     # Wait for audio preparation to complete (or timeout after 5 seconds)
+                    # This caches the audio and reduces the delay before playback
+                    if task is None:
+                        return
                     try:
-                        await asyncio.wait_for(preparation_task, timeout=5.0)
-                        logger.info(f"Audio prepared and ready for playback")
+                        await asyncio.wait_for(task, timeout=5.0)
+                        logger.info("Audio prepared and ready for playback")
                     except asyncio.TimeoutError:
                         logger.warning(f"Audio preparation timed out, proceeding anyway")
-                except Exception as e:
-                    logger.warning(f"Audio preparation not supported or failed: {str(e)}")
+                    except Exception as e:
+                        logger.warning(f"Audio preparation not supported or failed: {str(e)}")
+
+                # Audio preparation and storage are independent, so start both
+                # at once; only the audio is awaited before speaking
+                speech_interrupted.clear()
+                preparation_task = start_preparation(sentences[0])
 
-                # Now add to conversation history right before speaking
-                # This ensures transcription appears at roughly the same time as audio
-                conversation_history.append(assistant_message)
+                record_message(assistant_message)
+                message_recorded = True
 
-                # Create a background task for storage instead of awaiting it
+                # Hand off to the background storage worker instead of awaiting it
                 # This prevents blocking the speech
-                storage_task = asyncio.create_task(store_conversation_message(
+                enqueue_conversation_message(
                     session_id=session_id,
                     participant_id="assistant",
                     conversation=assistant_message
-                ))
+                )
 
                 # Now begin speaking (speech and transcript should be closely synchronized)
                 try:
                     # Set a speaking flag before starting speech
-                    if hasattr(agent, 'is_speaking'):
-                        agent.is_speaking = True
+                    agent.is_speaking = True
+
+                    for i, sentence in enumerate(sentences):
+                        await wait_for_preparation(preparation_task)
+                        preparation_task = (
+                            start_preparation(sentences[i + 1])
+                            if i + 1 < len(sentences) else None)
+                        speech_handle = await agent.say(sentence, allow_interruptions=True)
 
-                    await agent.say(message_text, allow_interruptions=True)
+                        # A barge-in stops the whole reply, not just this sentence
+                        if speech_interrupted.is_set() or getattr(speech_handle, "interrupted", False):
+                            logger.info(
+                                "Speech interrupted by the user, skipping %d remaining sentences",
+                                len(sentences) - i - 1)
+                            if preparation_task is not None:
+                                preparation_task.cancel()
+                            break
                     logger.info("Speech completed successfully (agent.say returned).")
 
                     # Reset speaking flag after speech completes
-                    if hasattr(agent, 'is_speaking'):
-                        agent.is_speaking = False
+                    agent.is_speaking = False
 
                 except asyncio.TimeoutError:
                     logger.error("Timeout occurred during agent.say")
                     # Reset speaking flag on error
-                    if hasattr(agent, 'is_speaking'):
-                        agent.is_speaking = False
+                    agent.is_speaking = False
                 except Exception as say_e:
                     logger.error(f"Error during agent.say: {say_e}")
                     logger.error(f"Error type: {type(say_e)}")
                     # Reset speaking flag on error
-                    if hasattr(agent, 'is_speaking'):
-                        agent.is_speaking = False
+                    agent.is_speaking = False
 
                 logger.info("Speech completed")
 
-                # Wait for storage to complete after speech is done
-                try:
-                    await asyncio.wait_for(storage_task, timeout=2.0)
-                except asyncio.TimeoutError:
-                    logger.warning("Storage task timed out, continuing anyway")
-
             except Exception as e:
                 logger.error(f"Error in say_and_store: {str(e)}")
                 logger.error(f"Error type: {type(e)}")
                 logger.error(f"Full error details: {repr(e)}")
 
                 # Reset speaking flag in case of errors
-                if hasattr(agent, 'is_speaking'):
-                    agent.is_speaking = False
+                agent.is_speaking = False
 
                 # Ensure the message is still stored even if speaking fails
-                if 'assistant_message' in locals() and assistant_message not in conversation_history:
-                    conversation_history.append(assistant_message)
-                    # Use create_task instead of awaiting
-                    asyncio.create_task(store_conversation_message(
+                if 'assistant_message' in locals() and not message_recorded:
+                    record_message(assistant_message)
+                    # Hand off to the background storage worker
+                    enqueue_conversation_message(
                         session_id=session_id,
                         participant_id="assistant",
                         conversation=assistant_message
-                    ))
+                    )
                     logger.error("Stored message despite speech error")
 
         # Send initial welcome message
@@ -2272,14 +2168,31 @@ async def run_multimodal_agent(ctx: JobContext, participant: rtc.Participant):
         # Ensure initial messages are stored
         await ensure_storage_completed()
 
+        # The event handlers store every later turn through the storage
+        # workers, saver and retry processor, so keep them running until the
+        # participant leaves or the room closes
+        try:
+            await asyncio.wait_for(session_ended.wait(), timeout=MAX_SESSION_DURATION)
+            logger.info("Session ended, stopping background storage tasks")
+        except asyncio.TimeoutError:
+            logger.warning(
+                f"Session still open after {MAX_SESSION_DURATION}s, stopping background storage tasks")
+
     finally:
         # Cleanup tasks
         try:
+            # Let the storage worker flush queued messages before it is cancelled
+            try:
+                await drain_storage_queue()
+            except Exception as e:
+                logger.error(f"Error draining storage queue: {e}")
+
             # Cancel any running tasks - safely handle task cancellation
             tasks_to_cancel = [
                 ('timeout_task', timeout_task),
                 ('periodic_saver_task', periodic_saver_task),
                 ('retry_processor_task', retry_processor_task),
+                *((f'storage_worker_task_{i}', task) for i, task in enumerate(storage_worker_tasks)),
                 ('connection_checker_task', connection_checker_task if 'connection_checker_task' in locals() else None)
             ]
 
@@ -2305,67 +2218,102 @@ async def run_multimodal_agent(ctx: JobContext, participant: rtc.Participant):
                 logger.error(f"Error processing retry queue during shutdown: {e}")
 
             # Final log for debugging
-            logger.info(f"Agent shutdown complete, {len(conversation_history)} messages in conversation history")
+            logger.info(f"Agent shutdown complete, {recorded_message_count} messages recorded this session")
 
         except Exception as e:
             logger.error(f"Error during agent shutdown: {e}")
             # Skip creating local backup to avoid serialization errors
 
+# Initialize every external client once per worker process
+async def init_clients():
+    """Load the environment and initialize Supabase, Pinecone, OpenAI and Gemini"""
+    global clients_ready
+
+    # Later jobs in the same process wait for (and reuse) the first init,
+    # retrying only Supabase if it could not be reached the first time
+    if clients_ready is not None:
+        await clients_ready.wait()
+        init_apis()  # Only rebuilds clients released at the last job shutdown
+        return supabase is not None or await init_supabase()
+
+    clients_ready = asyncio.Event()
+    try:
+        load_env_files()
+
+        # OpenAI and Gemini setup is local; Supabase and Pinecone need the network
+        init_apis()
+        supabase_ok, pinecone_ok = await asyncio.gather(
+            init_supabase(), asyncio.to_thread(init_pinecone))
+        if not pinecone_ok:
+            logger.warning("Pinecone initialization failed. Knowledge base functionality will be unavailable.")
+        return supabase_ok
+    finally:
+        clients_ready.set()
+
+# Shared HTTP client for OpenAI and other outbound HTTP calls
+def get_http_client():
+    """Return the shared httpx.AsyncClient, creating it if needed"""
+    global http_client
+    if http_client is None or http_client.is_closed:
+        http_client = httpx.AsyncClient(
+            http2=True, limits=HTTP_CLIENT_LIMITS, timeout=HTTP_CLIENT_TIMEOUT)
+    return http_client
+
+
+async def close_http_client():
+    """Close the shared HTTP client and its pooled connections"""
+    global http_client, openai_client
+    if http_client is not None and not http_client.is_closed:
+        await http_client.aclose()
+    http_client = None
+    # The OpenAI client is bound to the closed pool; init_apis rebuilds it
+    openai_client = None
+
 # Initialize the OpenAI and Gemini APIs
 def init_apis():
+    """Create the OpenAI client and configure Gemini, skipping what already exists"""
     global openai_client, gemini_initialized
 
-    # Initialize OpenAI client
-    openai_api_key = os.environ.get("OPENAI_API_KEY")
-    if openai_api_key:
-        try:
-            openai_client = OpenAI(api_key=openai_api_key)
-            logger.info("OpenAI client initialized successfully")
-        except Exception as e:
-            logger.error(f"Failed to initialize OpenAI client: {str(e)}")
-    else:
-        logger.warning("OPENAI_API_KEY not set, some functionality may be limited")
+    # Initialize OpenAI client once; it is reused until its pool is closed
+    if openai_client is None:
+        openai_api_key = os.environ.get("OPENAI_API_KEY")
+        if openai_api_key:
+            try:
+                openai_client = AsyncOpenAI(
+                    api_key=openai_api_key, http_client=get_http_client())
+                logger.info("OpenAI client initialized successfully")
+            except Exception as e:
+                logger.error(f"Failed to initialize OpenAI client: {str(e)}")
+        else:
+            logger.warning("OPENAI_API_KEY not set, some functionality may be limited")
 
-    # Initialize Gemini API
-    gemini_api_key = os.environ.get("GEMINI_API_KEY")
-    if gemini_api_key:
-        try:
-            genai.configure(api_key=gemini_api_key)
-            gemini_initialized = True
-            logger.info("Gemini API initialized successfully")
-        except Exception as e:
-            logger.error(f"Failed to initialize Gemini API: {str(e)}")
-    else:
-        logger.warning("GEMINI_API_KEY not set, web search functionality may be limited")
+    # Initialize Gemini API (the SDK is configured process-wide, once)
+    if not gemini_initialized:
+        gemini_api_key = os.environ.get("GEMINI_API_KEY")
+        if gemini_api_key:
+            try:
+                genai.configure(api_key=gemini_api_key)
+                gemini_initialized = True
+                logger.info("Gemini API initialized successfully")
+            except Exception as e:
+                logger.error(f"Failed to initialize Gemini API: {str(e)}")
+        else:
+            logger.warning("GEMINI_API_KEY not set, web search functionality may be limited")
 
 def sync_init_supabase():
-    """Synchronous wrapper for async Supabase initialization"""
-    import asyncio
-    import dotenv
-    
-    # Load .env files first
-    dotenv.load_dotenv()
-    
-    # Get Supabase credentials
-    supabase_url = os.environ.get("SUPABASE_URL")
-    supabase_key = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
-    
-    # Print debug info
-    logger.error(f"Initial env vars - SUPABASE_URL: {supabase_url}")
-    logger.error(f"Initial env vars - SUPABASE_SERVICE_ROLE_KEY exists: {bool(supabase_key)}")
-    
-    # Try to read from .env file directly for debugging
-    # ... (existing code)
-    
-    # Create a new event loop for this function only
-    try:
-        # Use a new event loop that we explicitly manage
-        loop = asyncio.new_event_loop()
-        result = loop.run_until_complete(init_supabase())
-        return result
-    finally:
-        # Always close the loop when done to avoid interference with the main loop
-        loop.close()
+    """Check at startup that Supabase is reachable and its table exists"""
+    # The main process has not run init_clients, so load .env here first
+    load_env_files()
+
+    async def check_supabase():
+        try:
+            return await init_supabase()
+        finally:
+            # The client belongs to this short-lived loop; each worker creates
+            # its own on its running loop in init_clients
+            await close_supabase_client()
+
+    return asyncio.run(check_supabase())
 
 # --- Pinecone Initialization and Querying --- #
 
@@ -2408,34 +2356,79 @@ def init_pinecone():
         pinecone_index = None
         return False
 
-def get_embedding(text: str, model: str = EMBEDDING_MODEL):
-    """Generates embeddings for the given text using OpenAI."""
+async def get_embeddings(texts: list[str], model: str = None):
+    """
+    Generates embeddings for several texts using as few OpenAI requests as possible.
+
+    Args:
+        texts: The texts to embed
+        model: The embedding model to use (defaults to EMBEDDING_MODEL)
+
+    Returns:
+        A list of embeddings in the same order as texts, or None on failure
+    """
     if not openai_client:
         logger.error("OpenAI client not initialized. Cannot generate embeddings.")
         return None
+    model = model or EMBEDDING_MODEL
+    # Only text-embedding-3 models accept a dimensions argument
+    options = {"dimensions": EMBEDDING_DIMENSIONS} if EMBEDDING_DIMENSIONS else {}
     try:
-        text = text.replace("\n", " ")
-        response = openai_client.embeddings.create(input=[text], model=model)
-        return response.data[0].embedding
+        inputs = [text.replace("\n", " ") for text in texts]
+        # Key by model, size and a digest of the text so long inputs stay cheap to hold
+        keys = [(model, EMBEDDING_DIMENSIONS, hashlib.sha256(text.encode()).digest()) for text in inputs]
+        embeddings = [embedding_cache.get(key) for key in keys]
+        misses = [i for i, embedding in enumerate(embeddings) if embedding is None]
+
+        for start in range(0, len(misses), EMBEDDING_BATCH_SIZE):
+            batch = misses[start:start + EMBEDDING_BATCH_SIZE]
+            response = await openai_client.embeddings.create(
+                input=[inputs[i] for i in batch], model=model, **options)
+            # The API may return items out of order; map each back by its index
+            for item in response.data:
+                i = batch[item.index]
+                embeddings[i] = embedding_cache[keys[i]] = item.embedding
+        return embeddings
     except Exception as e:
-        logger.error(f"Failed to get embedding from OpenAI: {str(e)}")
+        logger.error(f"Failed to get embeddings from OpenAI: {str(e)}")
         return None
 
+async def get_embedding(text: str, model: str = None):
+    """Generates embeddings for the given text using OpenAI."""
+    embeddings = await get_embeddings([text], model=model)
+    return embeddings[0] if embeddings else None
+
+async def run_pinecone_query(**kwargs):
+    """Runs pinecone_index.query on the Pinecone thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        pinecone_executor, partial(pinecone_index.query, **kwargs))
+
 async def query_pinecone_knowledge_base(query: str, top_k: int = 3):
     """Queries the Pinecone knowledge base and returns relevant text chunks."""
     if not pinecone_index:
         logger.warning("Pinecone index not available, skipping knowledge base query.")
         return "Internal knowledge base is currently unavailable."
 
+    cache_key = (normalize_query(query), top_k)
+    cached_result = knowledge_base_cache.get(cache_key)
+    if cached_result is not None:
+        logger.info("Returning cached knowledge base results for: %.50s...", query)
+        return cached_result
+    if cache_key in knowledge_base_negative_cache:
+        logger.info("Knowledge base recently had no results for: %.50s...", query)
+        return KNOWLEDGE_BASE_NO_RESULTS
+
     try:
-        logger.info(f"Generating embedding for knowledge base query: {query[:50]}...")
-        query_embedding = get_embedding(query)
+        logger.info("Generating embedding for knowledge base query: %.50s...", query)
+        query_embedding = await get_embedding(query)
 
         if not query_embedding:
             return "Could not process query for the knowledge base."
 
-        logger.info(f"Querying Pinecone index '{PINECONE_INDEX_NAME}'...")
-        results = pinecone_index.query(
+        logger.info("Querying Pinecone index '%s'...", PINECONE_INDEX_NAME)
+        # The Pinecone client is synchronous; keep its HTTP call off the event loop
+        results = await run_pinecone_query(
             vector=query_embedding,
             top_k=top_k,
             include_metadata=True # Assuming metadata contains the text
@@ -2443,23 +2436,28 @@ async def query_pinecone_knowledge_base(query: str, top_k: int = 3):
 
         if not results or not results.matches:
             logger.info("No relevant documents found in knowledge base.")
-            return "No specific information found in the knowledge base for that query."
+            knowledge_base_negative_cache[cache_key] = True
+            return KNOWLEDGE_BASE_NO_RESULTS
 
-        # Format results
-        context_str = "Found relevant information in the knowledge base:\n"
-        for i, match in enumerate(results.matches):
-            score = match.score
-            text_chunk = match.metadata.get('text', '[No text found in metadata]') # Adjust metadata field if needed
-            source = match.metadata.get('source', 'Unknown source') # Example: get source if available
-            context_str += f"\n{i+1}. (Score: {score:.2f}) From {source}:\n{text_chunk}\n"
-
-        logger.info(f"Returning {len(results.matches)} results from knowledge base.")
-        return context_str.strip()
+        logger.info("Returning %d results from knowledge base.", len(results.matches))
+        context_str = format_knowledge_base_matches(results.matches)
+        knowledge_base_cache[cache_key] = context_str
+        return context_str
 
     except Exception as e:
         logger.error(f"Error querying Pinecone knowledge base: {str(e)}")
         return f"An error occurred while accessing the knowledge base: {str(e)}"
 
+def format_knowledge_base_matches(matches):
+    """Formats Pinecone matches into the context string handed to the model."""
+    context_str = "Found relevant information in the knowledge base:\n"
+    for i, match in enumerate(matches):
+        score = match.score
+        text_chunk = match.metadata.get('text', '[No text found in metadata]') # Adjust metadata field if needed
+        source = match.metadata.get('source', 'Unknown source') # Example: get source if available
+        context_str += f"\n{i+1}. (Score: {score:.2f}) From {source}:\n{text_chunk}\n"
+    return context_str.strip()
+
 # --- End Pinecone --- #
 
 # Initialize local backup directory - DISABLED to avoid file serialization issues
@@ -2477,8 +2475,6 @@ def save_retry_queue():
 # Add a message to retry queue
 def add_to_retry_queue(session_id, participant_id, conversation):
     """Add a failed message to the retry queue (in-memory only)"""
-    global retry_queue
-
     # Make a safe copy of the message data to avoid serialization issues
     try:
         # First try to extract only the essential data to avoid coroutines
@@ -2486,7 +2482,7 @@ def add_to_retry_queue(session_id, participant_id, conversation):
             "role": conversation.get("role", "unknown"),
             "content": conversation.get("content", ""),
             "timestamp": conversation.get("timestamp", get_current_timestamp()),
-            "message_id": conversation.get("message_id", str(uuid.uuid4()))
+            "message_id": conversation.get("message_id") or new_message_id()
         }
 
         # Create a retry item that matches the Supabase table structure
@@ -2503,12 +2499,13 @@ def add_to_retry_queue(session_id, participant_id, conversation):
             "retry_count": 0
         }
 
-        # Add to queue and trim if too large
+        # Add to queue; the deque drops the oldest message once full
         retry_queue.append(retry_item)
-        if len(retry_queue) > MAX_RETRY_QUEUE_SIZE:
-            retry_queue = retry_queue[-MAX_RETRY_QUEUE_SIZE:]  # Keep only the newest messages
+        # The retry processor now owns the message; keep the full flush from
+        # writing it a second time
+        pending_messages.pop(safe_message["message_id"], None)
 
-        logger.info(f"Added message to retry queue (queue size: {len(retry_queue)})")
+        logger.info("Added message to retry queue (queue size: %d)", len(retry_queue))
         return True
     except Exception as e:
         logger.error(f"Failed to add message to retry queue: {e}")
@@ -2517,8 +2514,6 @@ def add_to_retry_queue(session_id, participant_id, conversation):
 # Add a dedicated retry processor with adjustable batch size
 async def process_retry_queue(batch_size=10):
     """Process the retry queue to attempt to store failed messages"""
-    global retry_queue
-
     if not retry_queue:
         return 0
 
@@ -2533,72 +2528,49 @@ async def process_retry_queue(batch_size=10):
     processed_count = 0
     success_count = 0
 
-    # Process only up to batch_size items per run to limit impact
+    # Process only up to batch_size items per run to limit impact, taking
+    # them off the front of the queue
     items_to_process = min(batch_size, len(retry_queue))
-    temp_queue = retry_queue[:items_to_process]
-
-    # Remove processed items from the queue
-    retry_queue = retry_queue[items_to_process:]
+    temp_queue = [retry_queue.popleft() for _ in range(items_to_process)]
 
+    # Skip items that have been retried too many times
+    batch = []
     for item in temp_queue:
         processed_count += 1
-
-        # Skip items that have been retried too many times
         if item.get("retry_count", 0) >= 5:
             logger.warning(f"Skipping message that has failed {item['retry_count']} times")
             continue
+        batch.append(item)
 
-        # Attempt to store the message directly to Supabase
+    if batch:
         try:
-            # Check Supabase health synchronously before attempting storage
-            supabase_healthy = await check_supabase_health()
+            # Check Supabase health before attempting storage
+            if not await check_supabase_health():
+                raise RuntimeError("Supabase connection not healthy")
 
-            if not supabase_healthy:
-                logger.warning("Supabase connection not healthy, adding back to retry queue")
-                item["retry_count"] = item.get("retry_count", 0) + 1
-                retry_queue.append(item)
-                continue
-
-            # Prepare the item for direct storage to match Supabase table structure
-            conversation_data = item.get("conversation", {})
-            if not isinstance(conversation_data, str):
-                conversation_data = json.dumps(conversation_data)
-
-            insert_data = {
-                "session_id": item.get("session_id"),
-                "participant_id": item.get("participant_id"),
-                "conversation": conversation_data,
-                "raw_conversation": item.get("raw_conversation", ""),
-                "message_count": item.get("message_count", 1),
-                "user_email": item.get("user_email", ""),
-                "timestamp": item.get("timestamp", get_current_timestamp()),
-                "email_sent": item.get("email_sent", False)
-            }
+            # Store the whole batch in one upsert, one row per distinct message
+            rows = build_unique_rows(
+                (item.get("session_id"), item.get("participant_id"), item.get("conversation", {}))
+                for item in batch)
 
-            # Insert directly to Supabase using proper structure
-            response = (
+            response = await (
                 supabase.table("conversation_histories")
-                .upsert([insert_data], on_conflict="session_id,timestamp")
+                .upsert([row for _, row in rows.values()], on_conflict="session_id,timestamp")
                 .execute()
             )
+            if not (hasattr(response, 'data') and response.data):
+                raise RuntimeError(f"Unexpected response from Supabase: {response}")
 
-            if hasattr(response, 'data') and response.data:
-                success_count += 1
-                # Message was successfully stored, no need to add back to queue
-                logger.info(f"Successfully stored retry item for session {item['session_id']}")
-            else:
-                # Message storage failed, increment retry count and add back to the queue
-                logger.warning(f"Failed to store retry item: {response}")
-                item["retry_count"] = item.get("retry_count", 0) + 1
-                retry_queue.append(item)
+            # Message was successfully stored, no need to add back to queue;
+            # repeats of the same message were sent as one row
+            success_count = len(rows)
+            logger.info("Successfully stored %d retry items", success_count)
         except Exception as e:
-            logger.error(f"Error processing retry item: {e}")
+            logger.error(f"Error processing retry batch: {e}")
             # Add back to queue with incremented retry count
-            item["retry_count"] = item.get("retry_count", 0) + 1
-            retry_queue.append(item)
-
-        # Yield control back to the event loop more frequently
-        await asyncio.sleep(0.2)
+            for item in batch:
+                item["retry_count"] = item.get("retry_count", 0) + 1
+                retry_queue.append(item)
 
     logger.info(f"Retry queue processing: {success_count}/{processed_count} messages stored, {len(retry_queue)} remaining")
 
@@ -2620,13 +2592,13 @@ async def periodic_retry_processor():
                 continue
 
             # Skip if agent is actively speaking to avoid interruptions
-            if agent and (hasattr(agent, 'is_speaking') and agent.is_speaking or
-                         hasattr(agent, 'should_pause_background_tasks') and agent.should_pause_background_tasks()):
+            if agent_is_busy():
                 logger.debug("Skipping retry processing during active speech")
                 continue
 
-            # Only process when supabase is connected and retry queue has items
-            if await init_supabase():
+            # Only process when supabase is connected and retry queue has items.
+            # The health check only rebuilds the client when the probe fails.
+            if await check_supabase_health():
                 # Process a smaller batch size to reduce impact
                 try:
                     await process_retry_queue(batch_size=5)
@@ -2640,37 +2612,187 @@ async def periodic_retry_processor():
     except Exception as e:
         logger.error(f"Error in periodic retry processor: {e}")
 
-# Custom exception for forced disconnection
-class ForceDisconnectError(Exception):
-    """Raised to force a disconnection in certain scenarios"""
-    pass
+# Start the background consumers for the storage queue
+def start_storage_worker():
+    """Create the storage queue and spawn its worker pool if not running"""
+    global storage_queue, storage_worker_tasks
+
+    if any(not task.done() for task in storage_worker_tasks):
+        return storage_worker_tasks
+
+    if storage_queue is None:
+        storage_queue = asyncio.Queue(maxsize=STORAGE_QUEUE_MAX_SIZE)
+
+    storage_worker_tasks = [
+        asyncio.create_task(storage_worker(worker_id))
+        for worker_id in range(STORAGE_WORKER_COUNT)
+    ]
+    logger.info(f"Started {STORAGE_WORKER_COUNT} background storage worker tasks")
+    return storage_worker_tasks
+
+# Start a one-off storage task that is kept alive and awaited at session end
+def track_store_task(coro):
+    """Run a storage coroutine in the background, tracked in pending_stores"""
+    task = asyncio.create_task(coro)
+    pending_stores.add(task)
+    task.add_done_callback(pending_stores.discard)
+    return task
+
+# Queue a message for background storage without awaiting Supabase
+def enqueue_conversation_message(session_id, participant_id, conversation):
+    """Queue a conversation message for the storage workers (non-blocking)"""
+    if storage_queue is None or all(task.done() for task in storage_worker_tasks):
+        # Workers not running (not started yet, or stopped at session end) -
+        # fall back to a one-off background task
+        track_store_task(store_conversation_message(
+            session_id=session_id,
+            participant_id=participant_id,
+            conversation=conversation
+        ))
+        return True
+
+    try:
+        storage_queue.put_nowait((session_id, participant_id, conversation))
+        storage_queue_stats["enqueued"] += 1
+        depth = storage_queue.qsize()
+        if depth > storage_queue_stats["max_depth"]:
+            storage_queue_stats["max_depth"] = depth
+        return True
+    except asyncio.QueueFull:
+        # Backpressure: nothing is dropped, the retry processor picks it up later
+        storage_queue_stats["spilled"] += 1
+        logger.warning("Storage queue is full, adding message to retry queue")
+        add_to_retry_queue(session_id, participant_id, conversation)
+        return False
+
+# Store several queued messages in a single Supabase upsert
+async def store_conversation_messages_bulk(items):
+    """Upsert (session_id, participant_id, message) items in one request; returns how many were stored"""
+    def defer(deferred_items):
+        for session_id, participant_id, conversation in deferred_items:
+            add_to_retry_queue(session_id, participant_id, conversation)
+
+    if not supabase and not await check_supabase_health():
+        logger.error("Supabase client not available, adding batch to retry queue")
+        defer(items)
+        return 0
+
+    # As in store_conversation_message, system messages recorded while the
+    # agent is speaking are deferred to the retry queue, and empty ones skipped
+    if agent_is_busy():
+        defer(item for item in items if item[1] == "system" and item[2])
+        items = [item for item in items if item[1] != "system"]
+    items = [item for item in items if item[2]]
+    if not items:
+        return 0
+
+    for _, _, conversation in items:
+        if "message_id" not in conversation:
+            conversation["message_id"] = new_message_id()
+
+    rows = build_unique_rows(items)
+
+    try:
+        response = await (
+            supabase.table("conversation_histories")
+            .upsert([row for _, row in rows.values()], on_conflict="session_id,timestamp")
+            .execute()
+        )
+        if not (hasattr(response, 'data') and response.data):
+            raise RuntimeError(f"Unexpected response from Supabase: {response}")
+    except Exception as e:
+        logger.error(f"Failed to store batch of {len(items)} messages: {e}")
+        defer(items)
+        return 0
+
+    for conversation, _ in rows.values():
+        conversation.setdefault("metadata", {})["stored"] = True
+        pending_messages.pop(conversation["message_id"], None)
+    logger.info("Stored batch of %d messages", len(rows))
+    return len(rows)
+
+# Long-lived consumer that performs the queued Supabase writes
+async def storage_worker(worker_id=0):
+    """Drain the storage queue, storing each collected batch in one upsert"""
+    try:
+        while True:
+            batch = [await storage_queue.get()]
+            try:
+                # Give a burst a short window to accumulate before writing
+                while len(batch) < STORAGE_BATCH_MAX and not storage_queue.empty():
+                    batch.append(storage_queue.get_nowait())
+                if len(batch) < STORAGE_BATCH_MAX:
+                    await asyncio.sleep(STORAGE_BATCH_WINDOW)
+                    while len(batch) < STORAGE_BATCH_MAX and not storage_queue.empty():
+                        batch.append(storage_queue.get_nowait())
+
+                stored = await store_conversation_messages_bulk(batch)
+                storage_queue_stats["stored"] += stored
+                storage_queue_stats["failed"] += len(batch) - stored
+            except Exception as e:
+                storage_queue_stats["failed"] += len(batch)
+                logger.error(f"Error in storage worker {worker_id}: {e}")
+            finally:
+                for _ in batch:
+                    storage_queue.task_done()
+    except asyncio.CancelledError:
+        logger.info(f"Storage worker task {worker_id} cancelled")
+
+# Wait for queued messages to be written before shutdown
+async def drain_storage_queue(timeout=10.0):
+    """Wait until the storage workers have processed every queued message"""
+    if storage_queue is None or all(task.done() for task in storage_worker_tasks):
+        return
+
+    try:
+        await asyncio.wait_for(storage_queue.join(), timeout=timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"Storage queue not drained within {timeout}s, {storage_queue.qsize()} messages left")
+    logger.info(f"Storage queue stats: {storage_queue_stats}")
+
+async def drain_pending_stores(timeout=PENDING_STORES_TIMEOUT):
+    """Await the tracked one-off storage tasks, each as soon as it finishes"""
+    if not pending_stores:
+        return
+
+    async def await_each():
+        for store in asyncio.as_completed(list(pending_stores)):
+            try:
+                await store
+            except Exception as e:
+                # Includes a task's own TimeoutError, which must not end the drain
+                logger.error(f"Background storage task failed: {e!r}")
+
+    # Only this overall deadline stops the drain; the tasks keep running
+    try:
+        await asyncio.wait_for(await_each(), timeout=timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"{len(pending_stores)} background storage tasks still running after {timeout}s")
 
 # Helper function to store assistant message
 async def store_assistant_message(msg_content: str, event_type: str):
     """Store an assistant message in the conversation history and Supabase."""
     try:
         # Check if this exact message is already in the conversation history
-        is_duplicate = False
-        for existing_msg in conversation_history:
-            if (existing_msg.get('role') == 'assistant' and
-                existing_msg.get('content') == msg_content):
-                is_duplicate = True
-                logger.info(f"Skipping duplicate assistant message from {event_type}")
-                break
-
-        if not is_duplicate:
+        if msg_content in assistant_contents:
+            logger.info("Skipping duplicate assistant message from %s", event_type)
+        else:
             # Add to conversation history
             assistant_message = {
                 "role": "assistant",
                 "content": msg_content,
-                "timestamp": datetime.utcnow().isoformat(),
+                "timestamp": get_current_timestamp(),
                 "metadata": {"type": "response", "event": event_type}
             }
-            conversation_history.append(assistant_message)
+            record_message(assistant_message)
 
-            # Store updated conversation in Supabase
-            await store_full_conversation()
-            logger.info(f"Added assistant message to conversation history from {event_type}, total messages: {len(conversation_history)}")
+            # Hand off to the background storage worker
+            enqueue_conversation_message(
+                session_id=session_id,
+                participant_id="assistant",
+                conversation=assistant_message
+            )
+            logger.info("Added assistant message to conversation history from %s, total messages: %d", event_type, recorded_message_count)
     except Exception as e:
         logger.error(f"Error storing assistant message from {event_type}: {str(e)}")
         logger.error(f"Error type: {type(e)}")
@@ -2680,6 +2802,10 @@ async def store_assistant_message(msg_content: str, event_type: str):
 async def ensure_storage_completed():
     """Ensure that conversation storage is completed before proceeding."""
     try:
+        # Let queued single-message writes land first so the full flush
+        # only has to pick up what is still pending
+        await drain_pending_stores()
+        await drain_storage_queue()
         await store_full_conversation()
         logger.info("Storage operation completed")
         return True
@@ -2695,25 +2821,16 @@ if __name__ == "__main__":
         import sys
         sys.exit(1)
 
-    # Initialize APIs
-    init_apis()
-
-    # Initialize Pinecone
-    if not init_pinecone():
-        logger.warning("Pinecone initialization failed. Knowledge base functionality will be unavailable.")
-
     # Start health check HTTP server for deployment verification
     def start_health_check_server():
         import threading
         import http.server
-        import socketserver
-        import json
         from datetime import datetime
         import version
 
         PORT = int(os.environ.get("HEALTH_CHECK_PORT", 8080))
 
-        class HealthCheckHandler(http.server.SimpleHTTPRequestHandler):
+        class HealthCheckHandler(http.server.BaseHTTPRequestHandler):
             def do_GET(self):
                 if self.path == "/health":
                     self.send_response(200)
@@ -2738,12 +2855,14 @@ if __name__ == "__main__":
                     }
 
                     # Send response
-                    self.wfile.write(json.dumps(health_data).encode())
+                    self.wfile.write(orjson.dumps(health_data))
                 else:
                     self.send_response(404)
                     self.end_headers()
 
-        httpd = socketserver.TCPServer(("", PORT), HealthCheckHandler)
+        # One thread per request, so a slow probe never holds up the next one
+        httpd = http.server.ThreadingHTTPServer(("", PORT), HealthCheckHandler)
+        httpd.daemon_threads = True
         logger.info(f"Health check server started on port {PORT}")
 
         # Run server in a separate thread
@@ -0,0 +1,36 @@
+import unittest
+
+try:
+    import main
+except ImportError:  # The agent's runtime dependencies are not installed
+    main = None
+
+
+@unittest.skipIf(main is None, "agent dependencies are not installed")
+class SplitSentencesTest(unittest.TestCase):
+    def test_splits_on_terminal_punctuation(self):
+        self.assertEqual(
+            main.split_sentences("Hi there. I'm Prepzo! How are you?"),
+            ["Hi there.", "I'm Prepzo!", "How are you?"])
+
+    def test_keeps_abbreviations_and_decimals_in_one_sentence(self):
+        self.assertEqual(
+            main.split_sentences("Dr. Smith is e.g. here. It costs 3.5 dollars."),
+            ["Dr. Smith is e.g. here.", "It costs 3.5 dollars."])
+
+    def test_sentence_final_i_and_a_still_split(self):
+        self.assertEqual(
+            main.split_sentences("So am I. Next one. I got an A. Great."),
+            ["So am I.", "Next one.", "I got an A.", "Great."])
+
+    def test_initials_followed_by_a_name_stay_together(self):
+        self.assertEqual(
+            main.split_sentences("Ask J. K. Rowling. She knows."),
+            ["Ask J. K. Rowling.", "She knows."])
+
+    def test_never_returns_an_empty_list(self):
+        self.assertEqual(main.split_sentences(""), [""])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import asyncio
+import unittest
+from types import SimpleNamespace
+
+try:
+    import main
+except ImportError:  # The agent's runtime dependencies are not installed
+    main = None
+
+
+class FakeTable:
+    """Records the rows of every upsert and echoes them back as stored"""
+
+    def __init__(self, upserts):
+        self.upserts = upserts
+        self.rows = None
+
+    def upsert(self, rows, on_conflict=None):
+        self.rows = rows
+        return self
+
+    async def execute(self):
+        self.upserts.append(self.rows)
+        return SimpleNamespace(data=self.rows, error=None)
+
+
+class FakeSupabase:
+    def __init__(self):
+        self.upserts = []
+
+    def table(self, name):
+        return FakeTable(self.upserts)
+
+
+@unittest.skipIf(main is None, "agent dependencies are not installed")
+class StoreConversationMessagesBulkTest(unittest.TestCase):
+    def setUp(self):
+        self.supabase = FakeSupabase()
+        self.original_supabase = main.supabase
+        main.supabase = self.supabase
+        main.reset_conversation_history()
+
+    def tearDown(self):
+        main.supabase = self.original_supabase
+        main.reset_conversation_history()
+
+    def test_messages_sharing_a_timestamp_are_both_stored(self):
+        timestamp = "2026-10-14T12:00:00+00:00"
+        first = {"role": "user", "content": "Hello", "timestamp": timestamp, "message_id": "a"}
+        second = {"role": "assistant", "content": "Hi", "timestamp": timestamp, "message_id": "b"}
+        main.pending_messages.update(a=first, b=second)
+
+        stored = asyncio.run(main.store_conversation_messages_bulk(
+            [("room", "user", first), ("room", "assistant", second)]))
+
+        self.assertEqual(stored, 2)
+        (rows,) = self.supabase.upserts
+        self.assertEqual(len({row["timestamp"] for row in rows}), 2)
+        self.assertEqual([row["raw_conversation"] for row in rows], ["Hello", "Hi"])
+        self.assertTrue(first["metadata"]["stored"])
+        self.assertTrue(second["metadata"]["stored"])
+        self.assertEqual(main.pending_messages, {})
+
+    def test_repeated_message_is_sent_once(self):
+        message = {"role": "user", "content": "Hello", "timestamp": "2026-10-14T12:00:00+00:00", "message_id": "a"}
+
+        stored = asyncio.run(main.store_conversation_messages_bulk(
+            [("room", "user", message), ("room", "user", message)]))
+
+        self.assertEqual(stored, 1)
+        (rows,) = self.supabase.upserts
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(message["timestamp"], "2026-10-14T12:00:00+00:00")
+
+
+if __name__ == "__main__":
+    unittest.main()